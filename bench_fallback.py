@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the keyword fallback classifier
+Compares scan_message (precompiled tables, one call for intent and
+ticket) against the original classify + extract implementation (the path all traffic takes when Gemini is
+down or unconfigured)
+"""
+import re
+import sys
+import timeit
+import config
+from gemini_handler import _fallback_classify, extract_ticket_number, scan_message
+
+
+SAMPLE_MESSAGES = [
+    ("My withdrawal is stuck for 3 days! This is unacceptable!", False),
+    ("I've raised a ticket but no response yet", False),
+    ("My ticket number is #12345", True),
+    ("It's been 2 hours since I messaged! When will you fix this?", False),
+    ("My email is user@gmail.com and password is 1234, please help!", False),
+    ("How do I enable 2FA on Mudrex?", False),
+    ("Any update on my ticket?", True),
+    ("@MudrexHelp deposit not credited, txn hash attached, please check asap " * 3, False),
+]
+
+
+def legacy_fallback_classify(message: str, is_dm: bool) -> str:
+    """The original implementation, kept here as the baseline"""
+    message_lower = message.lower()
+    
+    if any(word in message_lower for word in ["password", "login", "credentials", "@gmail", "@yahoo"]):
+        return "credentials_shared"
+    
+    if re.search(config.TICKET_PATTERN, message):
+        if is_dm:
+            return "dm_ticket_shared"
+        else:
+            return "has_ticket"
+    
+    if any(word in message_lower for word in ["ticket", "raised", "created", "submitted"]):
+        return "has_ticket"
+    
+    if any(word in message_lower for word in ["update", "status", "still waiting", "when", "how long"]):
+        return "follow_up"
+    
+    if any(word in message_lower for word in ["how to", "what is", "can i", "does mudrex"]):
+        return "general_question"
+    
+    return "new_complaint"
+
+
+def legacy_extract_ticket_number(message: str) -> str:
+    """The original implementation, kept here as the baseline"""
+    match = re.search(config.TICKET_PATTERN, message)
+    if match:
+        return match.group(1)
+    return None
+
+
+def legacy_pipeline():
+    for message, is_dm in SAMPLE_MESSAGES:
+        legacy_fallback_classify(message, is_dm)
+        legacy_extract_ticket_number(message)
+
+
+def compiled_pipeline():
+    for message, is_dm in SAMPLE_MESSAGES:
+        scan_message(message, is_dm)
+
+
+def main():
+    # Both implementations must agree before timing means anything
+    for message, is_dm in SAMPLE_MESSAGES:
+        expected = (legacy_fallback_classify(message, is_dm), legacy_extract_ticket_number(message))
+        actual = scan_message(message, is_dm)
+        if actual != expected or _fallback_classify(message, is_dm) != expected[0] \
+                or extract_ticket_number(message) != expected[1]:
+            print(f"❌ Mismatch for {message!r}: {actual} != {expected}")
+            sys.exit(1)
+    
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = number * len(SAMPLE_MESSAGES)
+    
+    legacy = min(timeit.repeat(legacy_pipeline, number=number, repeat=3))
+    compiled = min(timeit.repeat(compiled_pipeline, number=number, repeat=3))
+    
+    print(f"Messages per run: {messages}")
+    print(f"Legacy   (classify + extract): {legacy / messages * 1e6:.2f} µs/message")
+    print(f"Compiled (scan_message):       {compiled / messages * 1e6:.2f} µs/message")
+    print(f"Speedup: {legacy / compiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the bot's entry points
+Imports each module in a fresh interpreter with -X importtime, reports the
+cumulative import time (median of several runs) and the slowest imports
+under it, and fails when a module goes over its budget or drags in one of
+the heavy dependencies that should only load on first use
+
+    python bench_imports.py
+    python bench_imports.py --runs 9 --budget webhook_server=600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+# Milliseconds allowed per entry point (measured on a warm disk cache)
+DEFAULT_BUDGETS_MS = {
+    "webhook_server": 700,
+    "twitter_monitor": 200,
+    "twitter_handler": 200,
+    "supervisor": 100,
+    "reply_queue": 150,
+    "slack_handler": 100,
+    "gemini_handler": 150,
+    "database": 100,
+}
+
+# Loaded on first use only; importing an entry point must not pull them in
+LAZY_DEPENDENCIES = ("google.generativeai", "twikit", "requests", "uvicorn")
+
+# Child script: import the module and report which lazy dependencies loaded
+# (__import__ rather than importlib, which -X importtime doesn't report)
+_PROBE = (
+    "import json, sys; "
+    "__import__(sys.argv[1]); "
+    "print(json.dumps([m for m in json.loads(sys.argv[2]) if m in sys.modules]))"
+)
+
+
+def measure(module: str) -> Tuple[float, List[Tuple[str, float]], List[str]]:
+    """
+    Import a module once in a fresh interpreter
+    
+    Returns:
+        (cumulative ms, [(indented name, cumulative ms)] for everything the
+        module imported, lazy dependencies loaded)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE, module, json.dumps(LAZY_DEPENDENCIES)],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, PYTHONWARNINGS="ignore")
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr.strip()}")
+    
+    imports = []
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        # Nesting is shown as two spaces per level after the separator's space
+        name = name[1:].rstrip()
+        ms = int(cumulative) / 1000
+        if name == module:
+            total = ms
+            break
+        if not name.startswith(" "):
+            # A finished top-level import (e.g. from site at startup) isn't ours
+            imports = []
+            continue
+        imports.append((name, ms))
+    
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return total, imports, loaded
+
+
+def profile(module: str, runs: int, top: int) -> Dict:
+    """Median import time of a module over `runs` cold imports"""
+    totals = []
+    slowest: Dict[str, float] = {}
+    loaded: List[str] = []
+    for _ in range(runs):
+        total, imports, loaded = measure(module)
+        totals.append(total)
+        for name, ms in imports:
+            # Direct imports of the module sit one level in
+            if name.startswith("  ") and not name.startswith("    "):
+                slowest[name.strip()] = max(slowest.get(name.strip(), 0.0), ms)
+    
+    return {
+        "median_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "slowest": sorted(slowest.items(), key=lambda item: -item[1])[:top],
+        "lazy_loaded": loaded,
+    }
+
+
+def parse_budgets(overrides: List[str]) -> Dict[str, float]:
+    """DEFAULT_BUDGETS_MS with module=ms overrides applied"""
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    for override in overrides:
+        module, _, ms = override.partition("=")
+        budgets[module.strip()] = float(ms)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("modules", nargs="*", help="Modules to measure (default: every budgeted module)")
+    parser.add_argument("--runs", type=int, default=5, help="Cold imports per module")
+    parser.add_argument("--top", type=int, default=3, help="Slowest direct imports to show")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS", help="Override a budget")
+    parser.add_argument("--json", help="Also write results to this file")
+    args = parser.parse_args()
+    
+    budgets = parse_budgets(args.budget)
+    modules = args.modules or list(budgets)
+    
+    results = {}
+    failures = []
+    print(f"{'module':<18} {'median':>9} {'min':>9} {'budget':>8}  slowest direct imports")
+    for module in modules:
+        result = profile(module, args.runs, args.top)
+        budget = budgets.get(module)
+        result["budget_ms"] = budget
+        results[module] = result
+        
+        slowest = ", ".join(f"{name} {ms:.0f}ms" for name, ms in result["slowest"])
+        status = ""
+        if budget is not None and result["median_ms"] > budget:
+            status = "  ❌ over budget"
+            failures.append(module)
+        if result["lazy_loaded"]:
+            status += f"  ❌ loads {', '.join(result['lazy_loaded'])}"
+            failures.append(module)
+        print(f"{module:<18} {result['median_ms']:>7.1f}ms {result['min_ms']:>7.1f}ms "
+              f"{budget or 0:>6.0f}ms  {slowest}{status}")
+    
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    
+    if failures:
+        print(f"\n❌ {len(set(failures))} module(s) failed the import budget")
+        sys.exit(1)
+    print("\n✅ All modules within their import budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+End-to-end replay benchmark
+Replays a corpus of mentions and DMs through TwitterHandler.process_message,
+the webhook server and the Twitter monitor, with local stand-ins for Gemini
+(fake model with configurable latency), Slack (local HTTP sink) and twikit
+(fake client), and reports throughput and p50/p95/p99 latency per stage.
+
+    python benchmark.py --messages 500 --concurrency 8 --gemini-latency 300
+    python benchmark.py --corpus recorded.jsonl --modes webhook --json results.json
+
+A recorded corpus is JSON Lines with "username", "message" and optional
+"is_dm" fields. Nothing here talks to the real Gemini, Slack or X APIs.
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import math
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+SYNTHETIC_MENTIONS = [
+    "My withdrawal is stuck for {n} days! This is unacceptable!",
+    "I've raised a ticket about my deposit ({n}) but no response yet",
+    "It's been {n} hours since I messaged! When will you fix this?",
+    "My email is user{n}@gmail.com and password is 1234, please help!",
+    "How do I enable 2FA on Mudrex? Tried {n} times",
+    "Deposit of {n} USDT not credited, txn hash attached, please check asap",
+]
+
+SYNTHETIC_DMS = [
+    "My ticket number is #{ticket}",
+    "Any update on my ticket? Order {n}",
+    "Hi, I need help with order {n}",
+]
+
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+class StageRecorder:
+    def __init__(self):
+        """Thread-safe collection of per-stage latencies (seconds)"""
+        self.samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """count, mean, p50, p95 and p99 in milliseconds per stage"""
+        result = {}
+        with self._lock:
+            for stage, samples in self.samples.items():
+                result[stage] = {
+                    "count": len(samples),
+                    "mean_ms": statistics.fmean(samples) * 1000,
+                    "p50_ms": percentile(samples, 50) * 1000,
+                    "p95_ms": percentile(samples, 95) * 1000,
+                    "p99_ms": percentile(samples, 99) * 1000,
+                }
+        return result
+
+
+# Recorder of the mode currently running; stage wrappers write here
+recorder = StageRecorder()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(1, min(len(ordered), math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def timed(stage: str, fn):
+    """Wrap a sync or async callable so each call is recorded under `stage`"""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                recorder.record(stage, time.perf_counter() - started)
+        return async_wrapper
+    
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            recorder.record(stage, time.perf_counter() - started)
+    return wrapper
+
+
+def instrument(target, name: str, stage: str):
+    """Replace target.name with a timed wrapper"""
+    setattr(target, name, timed(stage, getattr(target, name)))
+
+
+# ---------------------------------------------------------------------------
+# Local stand-ins
+# ---------------------------------------------------------------------------
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    def __init__(self, latency: float):
+        """
+        Stand-in for genai.GenerativeModel
+        
+        Answers with the keyword classifier after `latency` seconds, for both
+        the single-message and the batch prompt.
+        """
+        self.latency = latency
+    
+    def _answer(self, prompt: str) -> str:
+        from gemini_handler import scan_message
+        
+        batch = re.search(r"\n(\[.*\])\n\nResponse format", prompt, re.DOTALL)
+        if batch:
+            items = json.loads(batch.group(1))
+            return json.dumps([
+                {"id": item["id"], "intent": scan_message(item["message"], item["is_dm"])[0]}
+                for item in items
+            ])
+        
+        message = re.search(r'Message: "(.*)"\nIs DM: (True|False)', prompt, re.DOTALL)
+        return scan_message(message.group(1), message.group(2) == "True")[0]
+    
+    def generate_content(self, prompt: str, request_options=None) -> FakeResponse:
+        time.sleep(self.latency)
+        return FakeResponse(self._answer(prompt))
+    
+    async def generate_content_async(self, prompt: str, request_options=None) -> FakeResponse:
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self._answer(prompt))
+
+
+class SlackSink:
+    def __init__(self, latency: float):
+        """Local HTTP server accepting Slack incoming-webhook posts"""
+        self.latency = latency
+        self.received = 0
+        sink = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(sink.latency)
+                sink.received += 1
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/slack"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.server.shutdown()
+
+
+class FakeUser:
+    def __init__(self, user_id: str, screen_name: str):
+        self.id = user_id
+        self.screen_name = screen_name
+
+
+class FakeTweet:
+    def __init__(self, tweet_id: int, item: Dict):
+        self.id = str(tweet_id)
+        self.user = FakeUser(f"u-{item['username']}", item["username"])
+        self.text = item["message"]
+        self.created_at = ""
+        self.in_reply_to = None
+
+
+class FakeSearchResult(list):
+    def __init__(self, tweets: List[FakeTweet], rest: List[FakeTweet], page_size: int, latency: float):
+        """One page of search results with twikit's async next()"""
+        super().__init__(tweets)
+        self._rest = rest
+        self._page_size = page_size
+        self._latency = latency
+    
+    async def next(self) -> "FakeSearchResult":
+        await asyncio.sleep(self._latency)
+        return FakeSearchResult(
+            self._rest[:self._page_size],
+            self._rest[self._page_size:],
+            self._page_size,
+            self._latency
+        )
+
+
+class FakeDMMessage:
+    def __init__(self, message_id: int, item: Dict):
+        self.id = str(message_id)
+        self.sender = FakeUser(f"u-{item['username']}", item["username"])
+        self.sender_id = self.sender.id
+        self.text = item["message"]
+        self.created_at = ""
+
+
+class FakeConversation:
+    def __init__(self, message: FakeDMMessage, latency: float):
+        self.id = f"conv-{message.id}"
+        self._message = message
+        self._latency = latency
+    
+    async def get_messages(self) -> List[FakeDMMessage]:
+        await asyncio.sleep(self._latency)
+        return [self._message]
+
+
+class FakeTwikitClient:
+    def __init__(self, mentions: List[Dict], dms: List[Dict], latency: float):
+        """Stand-in for twikit.Client serving a fixed corpus"""
+        self.latency = latency
+        # Search returns newest first
+        self._tweets = [FakeTweet(10_000 + i, item) for i, item in enumerate(mentions)][::-1]
+        self._conversations = [
+            FakeConversation(FakeDMMessage(50_000 + i, item), latency)
+            for i, item in enumerate(dms)
+        ]
+        self.sent = 0
+    
+    async def search_tweet(self, query: str, product: str, count: int) -> FakeSearchResult:
+        await asyncio.sleep(self.latency)
+        return FakeSearchResult(self._tweets[:count], self._tweets[count:], count, self.latency)
+    
+    async def get_dm_conversations(self) -> List[FakeConversation]:
+        await asyncio.sleep(self.latency)
+        # Each poll sees the conversations not answered yet
+        conversations, self._conversations = self._conversations[:20], self._conversations[20:]
+        return conversations
+    
+    async def create_tweet(self, text: str, reply_to: str = None):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+    
+    async def send_dm(self, user_id: str, text: str):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+
+
+# ---------------------------------------------------------------------------
+# Corpus
+# ---------------------------------------------------------------------------
+
+def synthetic_corpus(count: int, users: int, dm_ratio: float, seed: int) -> List[Dict]:
+    """Generate unique mentions and DMs spread over `users` usernames"""
+    rng = random.Random(seed)
+    corpus = []
+    for n in range(count):
+        is_dm = rng.random() < dm_ratio
+        template = rng.choice(SYNTHETIC_DMS if is_dm else SYNTHETIC_MENTIONS)
+        corpus.append({
+            "username": f"bench_user_{rng.randrange(users)}",
+            "message": template.format(n=n, ticket=rng.randrange(10000, 99999)),
+            "is_dm": is_dm,
+        })
+    return corpus
+
+
+def load_corpus(path: str) -> List[Dict]:
+    """Load a recorded corpus from JSON Lines"""
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("is_dm", False)
+                corpus.append(item)
+    return corpus
+
+
+# ---------------------------------------------------------------------------
+# Modes
+# ---------------------------------------------------------------------------
+
+def wait_for_slack(timeout: float = 60):
+    """Block until the Slack outbox is drained (or the timeout passes)"""
+    from database import db
+    
+    deadline = time.monotonic() + timeout
+    while db.count_pending_escalations() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def run_handler_mode(corpus: List[Dict], concurrency: int) -> float:
+    """process_message on a thread pool, classifying inline"""
+    from twitter_handler import handler
+    
+    def process(item: Dict):
+        handler.process_message(
+            username=item["username"],
+            message=item["message"],
+            is_dm=item["is_dm"],
+            tweet_url=f"https://twitter.com/{item['username']}/status/1"
+        )
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(process, corpus))
+    elapsed = time.perf_counter() - started
+    wait_for_slack()
+    return elapsed
+
+
+async def run_webhook_mode(corpus: List[Dict], concurrency: int, batch_size: int) -> float:
+    """Single-message and batch webhook requests through the ASGI app"""
+    import httpx
+    from webhook_server import app
+    
+    half = len(corpus) // 2
+    singles, batched = corpus[:half], corpus[half:]
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        post = timed("webhook_request", client.post)
+        post_batch = timed("webhook_batch_request", client.post)
+        
+        async def send(item: Dict):
+            async with semaphore:
+                response = await post("/webhook/twitter", json=item)
+                response.raise_for_status()
+        
+        async def send_batch(items: List[Dict]):
+            async with semaphore:
+                response = await post_batch("/webhook/twitter/batch", json=items)
+                response.raise_for_status()
+        
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(send(item) for item in singles),
+            *(send_batch(batched[i:i + batch_size]) for i in range(0, len(batched), batch_size))
+        )
+        elapsed = time.perf_counter() - started
+    
+    await asyncio.to_thread(wait_for_slack)
+    return elapsed
+
+
+async def run_monitor_mode(corpus: List[Dict], concurrency: int, twitter_latency: float) -> float:
+    """Fetch, classify, handle and reply through TwitterMonitor with a fake twikit"""
+    from database import db
+    from twitter_client import TwitterClient
+    from twitter_monitor import TwitterMonitor
+    
+    mentions = [item for item in corpus if not item["is_dm"]]
+    dms = [item for item in corpus if item["is_dm"]]
+    
+    fake = FakeTwikitClient(mentions, dms, twitter_latency)
+    for name, stage in [
+        ("search_tweet", "twikit_fetch"),
+        ("get_dm_conversations", "twikit_fetch"),
+        ("create_tweet", "reply_send"),
+        ("send_dm", "reply_send"),
+    ]:
+        instrument(fake, name, stage)
+    
+    client = TwitterClient(username="benchmark", email="-", password="-")
+    client.client = fake
+    client.authenticated = True
+    client.user_id = "u-MudrexHelp"
+    client.username = "MudrexHelp"
+    
+    page_size = 20
+    monitor = TwitterMonitor(
+        max_concurrency=concurrency,
+        mention_page_size=page_size,
+        mention_max_pages=len(mentions) // page_size + 2,
+        client=client,
+        account="benchmark"
+    )
+    # Start the mentions stream from the beginning of the corpus
+    db.advance_cursor("benchmark/mentions", "0")
+    
+    sender = asyncio.create_task(monitor.reply_queue.run())
+    started = time.perf_counter()
+    
+    await monitor.process_mentions()
+    while fake._conversations:
+        await monitor.process_dms()
+    while db.count_pending_replies():
+        await asyncio.sleep(0.01)
+    
+    elapsed = time.perf_counter() - started
+    monitor.reply_queue.stop()
+    await sender
+    monitor._executor.shutdown(wait=True)
+    await asyncio.to_thread(wait_for_slack)
+    return elapsed
+
+
+# ---------------------------------------------------------------------------
+# Setup and reporting
+# ---------------------------------------------------------------------------
+
+def configure_environment(args, slack_url: str, workdir: str):
+    """Point every setting at local stand-ins before repo modules import config"""
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "benchmark.db")
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ["SLACK_WEBHOOK_URL"] = slack_url
+    os.environ["SLACK_COALESCE_WINDOW"] = "0"
+    os.environ["INTENT_CACHE_ENABLED"] = "true" if args.intent_cache else "false"
+    # The token buckets exist to respect X's limits, not to be measured
+    os.environ["REPLY_TWEETS_PER_HOUR"] = "1e9"
+    os.environ["REPLY_DMS_PER_HOUR"] = "1e9"
+    os.environ["REPLY_TWEET_BURST"] = str(len(args.corpus_items))
+    os.environ["REPLY_DM_BURST"] = str(len(args.corpus_items))
+    if not args.verbose:
+        os.environ["LOG_LEVEL"] = "WARNING"
+
+
+def install_stand_ins(gemini_latency: float):
+    """Swap in the fake model and time the pipeline's stages"""
+    import gemini_handler
+    import slack_handler
+    from database import db
+    from twitter_handler import TwitterHandler
+    
+    gemini_handler._model = FakeGeminiModel(gemini_latency)
+    
+    instrument(gemini_handler, "classify_intent", "classify")
+    instrument(gemini_handler, "classify_intent_async", "classify")
+    instrument(gemini_handler, "classify_intents_batch_async", "classify_batch")
+    instrument(gemini_handler, "generate_response", "generate_response")
+    instrument(db, "get_user_state", "db_read")
+    instrument(db, "get_original_complaint", "db_read")
+    instrument(db, "save_conversation", "db_write")
+    instrument(db, "update_user_state", "db_write")
+    instrument(slack_handler, "enqueue_escalation", "escalation_enqueue")
+    instrument(slack_handler, "post_blocks", "slack_post")
+    instrument(TwitterHandler, "process_message", "handler")
+
+
+def print_report(results: Dict[str, Dict]):
+    """Print throughput and per-stage latency tables"""
+    for mode, result in results.items():
+        print(f"\n=== {mode}: {result['messages']} messages in {result['elapsed_s']:.2f}s "
+              f"-> {result['throughput_per_s']:.1f} msg/s ===")
+        print(f"{'stage':<24}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+        for stage, stats in sorted(result["stages"].items()):
+            print(f"{stage:<24}{stats['count']:>8}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+                  f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+def main():
+    global recorder
+    
+    parser = argparse.ArgumentParser(description="Replay benchmark for the support bot")
+    parser.add_argument("--messages", type=int, default=300, help="Synthetic corpus size")
+    parser.add_argument("--corpus", help="Recorded corpus (JSON Lines) instead of synthetic messages")
+    parser.add_argument("--users", type=int, default=50, help="Distinct users in the synthetic corpus")
+    parser.add_argument("--dm-ratio", type=float, default=0.3, help="Share of DMs in the synthetic corpus")
+    parser.add_argument("--modes", default="handler,webhook,monitor", help="Comma-separated modes to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel messages/requests")
+    parser.add_argument("--batch-size", type=int, default=25, help="Messages per webhook batch request")
+    parser.add_argument("--gemini-latency", type=float, default=200, help="Fake Gemini latency (ms)")
+    parser.add_argument("--slack-latency", type=float, default=50, help="Slack sink latency (ms)")
+    parser.add_argument("--twitter-latency", type=float, default=50, help="Fake twikit latency (ms)")
+    parser.add_argument("--intent-cache", action="store_true", help="Keep the intent cache enabled")
+    parser.add_argument("--seed", type=int, default=7, help="Synthetic corpus seed")
+    parser.add_argument("--json", help="Also write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+    
+    args.corpus_items = (
+        load_corpus(args.corpus) if args.corpus
+        else synthetic_corpus(args.messages, args.users, args.dm_ratio, args.seed)
+    )
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    
+    sink = SlackSink(args.slack_latency / 1000)
+    workdir = tempfile.mkdtemp(prefix="bot-benchmark-")
+    configure_environment(args, sink.url, workdir)
+    
+    quiet = open(os.devnull, "w") if not args.verbose else sys.stdout
+    with contextlib.redirect_stdout(quiet):
+        install_stand_ins(args.gemini_latency / 1000)
+    
+    results = {}
+    for mode in modes:
+        recorder = StageRecorder()
+        print(f"▶️  Running {mode} mode ({len(args.corpus_items)} messages)...", file=sys.stderr)
+        
+        with contextlib.redirect_stdout(quiet):
+            if mode == "handler":
+                elapsed = run_handler_mode(args.corpus_items, args.concurrency)
+            elif mode == "webhook":
+                elapsed = asyncio.run(run_webhook_mode(args.corpus_items, args.concurrency, args.batch_size))
+            elif mode == "monitor":
+                elapsed = asyncio.run(run_monitor_mode(
+                    args.corpus_items, args.concurrency, args.twitter_latency / 1000
+                ))
+            else:
+                parser.error(f"unknown mode: {mode}")
+        
+        results[mode] = {
+            "messages": len(args.corpus_items),
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(args.corpus_items) / elapsed,
+            "stages": recorder.summary(),
+        }
+    
+    import slack_handler
+    slack_handler.dispatcher.stop()
+    sink.close()
+    
+    print_report(results)
+    print(f"\nSlack sink received {sink.received} posts; database in {workdir}")
+    
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Bounded concurrency helpers shared by the monitor and the webhook server
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Sequence
+
+
+async def gather_in_key_order(
+    items: Sequence[Any],
+    key: Callable[[Any], Hashable],
+    worker: Callable[[Any], Awaitable[Any]],
+    limit: int
+) -> List[Any]:
+    """
+    Run worker(item) for every item with at most `limit` running at once
+    
+    Items that share a key (e.g. the same username) are processed one after
+    another in input order; items with different keys run concurrently.
+    
+    Args:
+        items: Items to process
+        key: Function returning the ordering key of an item
+        worker: Coroutine function processing a single item
+        limit: Maximum number of workers running at the same time
+    
+    Returns:
+        Results in input order; an item whose worker raised gets the
+        exception object instead, like asyncio.gather(return_exceptions=True)
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+    results: List[Any] = [None] * len(items)
+    
+    groups: Dict[Hashable, List[int]] = {}
+    for index, item in enumerate(items):
+        groups.setdefault(key(item), []).append(index)
+    
+    async def run_group(indexes: List[int]):
+        for index in indexes:
+            async with semaphore:
+                try:
+                    results[index] = await worker(items[index])
+                except Exception as e:
+                    results[index] = e
+    
+    await asyncio.gather(*(run_group(indexes) for indexes in groups.values()))
+    return results
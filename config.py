@@ -9,8 +9,98 @@ SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
 SLACK_CHANNEL = os.getenv("SLACK_CHANNEL", "#twitter-escalations")
 N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL", "http://localhost:5678/webhook/twitter-escalation")
 
+# Slack delivery (escalations go through a durable outbox)
+SLACK_TIMEOUT = float(os.getenv("SLACK_TIMEOUT", "10"))
+SLACK_POOL_SIZE = int(os.getenv("SLACK_POOL_SIZE", "4"))
+SLACK_MAX_ATTEMPTS = int(os.getenv("SLACK_MAX_ATTEMPTS", "8"))
+SLACK_RETRY_BASE_DELAY = float(os.getenv("SLACK_RETRY_BASE_DELAY", "2"))
+SLACK_RETRY_MAX_DELAY = float(os.getenv("SLACK_RETRY_MAX_DELAY", "900"))
+SLACK_DELIVERY_LEASE = float(os.getenv("SLACK_DELIVERY_LEASE", "60"))
+SLACK_IDLE_POLL_INTERVAL = float(os.getenv("SLACK_IDLE_POLL_INTERVAL", "5"))
+
+# Slack coalescing: escalations inside the window are sent as one digest
+# (0 disables); the first one after a quiet period is sent immediately
+SLACK_COALESCE_WINDOW = float(os.getenv("SLACK_COALESCE_WINDOW", "0"))
+SLACK_QUIET_PERIOD = float(os.getenv("SLACK_QUIET_PERIOD", "300"))
+SLACK_MAX_BLOCKS_PER_MESSAGE = int(os.getenv("SLACK_MAX_BLOCKS_PER_MESSAGE", "50"))
+SLACK_DIGEST_MAX_ESCALATIONS = int(os.getenv("SLACK_DIGEST_MAX_ESCALATIONS", "500"))
+
 # Database
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/conversations.db")
+DATABASE_CACHE_SIZE_KB = int(os.getenv("DATABASE_CACHE_SIZE_KB", "16384"))
+DATABASE_MMAP_SIZE = int(os.getenv("DATABASE_MMAP_SIZE", str(256 * 1024 * 1024)))
+DATABASE_BUSY_TIMEOUT_MS = int(os.getenv("DATABASE_BUSY_TIMEOUT_MS", "5000"))
+DATABASE_STATEMENT_CACHE_SIZE = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "128"))
+
+# Write-behind batching (conversation/user-state writes are queued and
+# group-committed by a background thread)
+DATABASE_WRITE_BEHIND = os.getenv("DATABASE_WRITE_BEHIND", "false").lower() == "true"
+DATABASE_WRITE_BATCH_SIZE = int(os.getenv("DATABASE_WRITE_BATCH_SIZE", "100"))
+DATABASE_WRITE_BATCH_INTERVAL_MS = int(os.getenv("DATABASE_WRITE_BATCH_INTERVAL_MS", "50"))
+DATABASE_WRITE_QUEUE_SIZE = int(os.getenv("DATABASE_WRITE_QUEUE_SIZE", "10000"))
+
+# Write-through LRU of per-user state in front of the user_state table
+# (0 disables it). Dropped whenever another process writes the database.
+USER_STATE_CACHE_SIZE = int(os.getenv("USER_STATE_CACHE_SIZE", "10000"))
+
+# Conversation retention (retention.py): rows older than RETENTION_DAYS move
+# to per-month gzip JSONL archives and are pruned in small batches
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "./data/archive")
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+# Sent/dead replies, delivered/dead escalations and settled ledger rows are
+# deleted after RETENTION_QUEUE_DAYS. Keep it well above how far back the
+# streams can be refetched, or old messages would be handled again.
+RETENTION_QUEUE_DAYS = int(os.getenv("RETENTION_QUEUE_DAYS", "30"))
+
+# Gemini client
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "15"))
+
+# Messages per Gemini call in classify_intents_batch
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "20"))
+
+# Intent classification cache (in-memory LRU + persistent SQLite tier)
+INTENT_CACHE_ENABLED = os.getenv("INTENT_CACHE_ENABLED", "true").lower() == "true"
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "10000"))
+INTENT_CACHE_TTL = int(os.getenv("INTENT_CACHE_TTL", "86400"))
+INTENT_CACHE_PERSISTENT = os.getenv("INTENT_CACHE_PERSISTENT", "true").lower() == "true"
+
+# Webhook server batch and streaming endpoints
+WEBHOOK_BATCH_CONCURRENCY = int(os.getenv("WEBHOOK_BATCH_CONCURRENCY", "8"))
+WEBHOOK_MAX_BATCH_SIZE = int(os.getenv("WEBHOOK_MAX_BATCH_SIZE", "100"))
+WEBHOOK_STREAM_CONCURRENCY = int(os.getenv("WEBHOOK_STREAM_CONCURRENCY", "8"))
+WEBHOOK_STREAM_MAX_LINE_BYTES = int(os.getenv("WEBHOOK_STREAM_MAX_LINE_BYTES", "65536"))
+
+# Webhook idempotency keys (retries replay the stored response)
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+
+# Outbound reply queue: token buckets sized to X's write limits, plus
+# retry with backoff for failed sends
+REPLY_TWEETS_PER_HOUR = float(os.getenv("REPLY_TWEETS_PER_HOUR", "100"))
+REPLY_TWEET_BURST = int(os.getenv("REPLY_TWEET_BURST", "10"))
+REPLY_DMS_PER_HOUR = float(os.getenv("REPLY_DMS_PER_HOUR", "400"))
+REPLY_DM_BURST = int(os.getenv("REPLY_DM_BURST", "20"))
+REPLY_MAX_ATTEMPTS = int(os.getenv("REPLY_MAX_ATTEMPTS", "6"))
+REPLY_RETRY_BASE_DELAY = float(os.getenv("REPLY_RETRY_BASE_DELAY", "30"))
+REPLY_RETRY_MAX_DELAY = float(os.getenv("REPLY_RETRY_MAX_DELAY", "3600"))
+REPLY_SEND_LEASE = float(os.getenv("REPLY_SEND_LEASE", "120"))
+REPLY_IDLE_POLL_INTERVAL = float(os.getenv("REPLY_IDLE_POLL_INTERVAL", "5"))
+
+# Metrics: seconds between snapshots logged by the monitor (0 disables)
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "300"))
+
+# Logging: records go through a bounded queue to a background writer
+# LOG_LEVELS overrides single modules, e.g. "twitter_client=DEBUG,database=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
 
 # Testing
 TESTING_MODE = os.getenv("TESTING_MODE", "true").lower() == "true"
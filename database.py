@@ -1,55 +1,691 @@
 """
 Database handler for tracking conversations
 """
+import os
 import sqlite3
+import threading
+import queue
+import time
+import atexit
 import json
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import groupby
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Set
 import config
+from logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+
+# Connection tuning applied once per connection. WAL lets readers run
+# alongside the writer, NORMAL sync only fsyncs at checkpoints, and the
+# negative cache_size is in KiB. auto_vacuum only takes effect on a new
+# file (or after one VACUUM); it lets retention hand pages back in steps.
+CONNECTION_PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA cache_size = -{config.DATABASE_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size = {config.DATABASE_MMAP_SIZE}",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {config.DATABASE_BUSY_TIMEOUT_MS}",
+)
+
+# SQL is kept as module constants so every call passes the exact same string
+# and hits sqlite3's per-connection prepared statement cache.
+INSERT_CONVERSATION_SQL = """
+    INSERT INTO conversations
+    (username, message, intent, response, is_dm, ticket_number, escalated, tweet_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# ON CONFLICT instead of INSERT OR REPLACE, which deletes the old row and
+# so reset escalation_count to its default on every update
+UPSERT_USER_STATE_SQL = """
+    INSERT INTO user_state
+    (username, last_intent, ticket_number, last_interaction)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (username) DO UPDATE SET
+        last_intent = excluded.last_intent,
+        ticket_number = excluded.ticket_number,
+        last_interaction = excluded.last_interaction
+"""
+
+SELECT_USER_STATE_SQL = """
+    SELECT last_intent, ticket_number, last_interaction, escalation_count
+    FROM user_state
+    WHERE username = ?
+"""
+
+INCREMENT_ESCALATION_SQL = """
+    INSERT INTO user_state (username, escalation_count)
+    VALUES (?, 1)
+    ON CONFLICT (username) DO UPDATE SET
+        escalation_count = escalation_count + 1
+"""
+
+SELECT_HISTORY_SQL = """
+    SELECT message, intent, response, is_dm, ticket_number, created_at
+    FROM conversations
+    WHERE username = ?
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+"""
+
+SELECT_CONVERSATIONS_AFTER_SQL = """
+    SELECT id, username, message, intent, response, is_dm, ticket_number,
+           escalated, tweet_id, created_at
+    FROM conversations
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+DELETE_CONVERSATIONS_RANGE_SQL = """
+    DELETE FROM conversations WHERE id > ? AND id <= ?
+"""
+
+SELECT_ORIGINAL_COMPLAINT_SQL = """
+    SELECT message
+    FROM conversations
+    WHERE username = ? AND intent IN ('new_complaint', 'has_ticket')
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1
+"""
+
+SELECT_PROCESSED_STATUSES_SQL = """
+    SELECT message_id, status FROM processed_messages
+    WHERE message_id IN (SELECT value FROM json_each(?))
+"""
+
+UPSERT_PROCESSED_SQL = """
+    INSERT INTO processed_messages (message_id, kind, status)
+    VALUES (?, ?, ?)
+    ON CONFLICT(message_id) DO UPDATE SET
+        status = excluded.status,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+SELECT_CURSOR_SQL = """
+    SELECT last_id FROM stream_cursors WHERE stream = ?
+"""
+
+# Cursors only ever move forward (ids are numeric snowflakes)
+ADVANCE_CURSOR_SQL = """
+    INSERT INTO stream_cursors (stream, last_id)
+    VALUES (?, ?)
+    ON CONFLICT(stream) DO UPDATE SET
+        last_id = excluded.last_id,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE CAST(excluded.last_id AS INTEGER) > CAST(stream_cursors.last_id AS INTEGER)
+"""
+
+SET_CURSOR_SQL = """
+    INSERT INTO stream_cursors (stream, last_id)
+    VALUES (?, ?)
+    ON CONFLICT(stream) DO UPDATE SET
+        last_id = excluded.last_id,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+DELETE_CURSOR_SQL = """
+    DELETE FROM stream_cursors WHERE stream = ?
+"""
+
+SELECT_CACHED_INTENT_SQL = """
+    SELECT intent, created_at FROM intent_cache
+    WHERE cache_key = ? AND created_at >= ?
+"""
+
+UPSERT_CACHED_INTENT_SQL = """
+    INSERT OR REPLACE INTO intent_cache (cache_key, intent, created_at)
+    VALUES (?, ?, ?)
+"""
+
+PRUNE_INTENT_CACHE_SQL = """
+    DELETE FROM intent_cache WHERE created_at < ?
+"""
+
+INSERT_ESCALATION_SQL = """
+    INSERT INTO slack_outbox (payload, next_attempt_at, created_at)
+    VALUES (?, ?, ?)
+"""
+
+SELECT_DUE_ESCALATIONS_SQL = """
+    SELECT id, payload, attempts, created_at
+    FROM slack_outbox
+    WHERE status = 'pending' AND next_attempt_at <= ?
+    ORDER BY next_attempt_at, id
+    LIMIT ?
+"""
+
+LEASE_ESCALATION_SQL = """
+    UPDATE slack_outbox SET next_attempt_at = ? WHERE id = ?
+"""
+
+MARK_ESCALATION_DELIVERED_SQL = """
+    UPDATE slack_outbox
+    SET status = 'delivered', attempts = attempts + 1, delivered_at = ?, last_error = NULL
+    WHERE id = ?
+"""
+
+MARK_ESCALATION_FAILED_SQL = """
+    UPDATE slack_outbox
+    SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+    WHERE id = ?
+"""
+
+SELECT_NEXT_ESCALATION_DUE_SQL = """
+    SELECT MIN(next_attempt_at) FROM slack_outbox WHERE status = 'pending'
+"""
+
+COUNT_PENDING_ESCALATIONS_SQL = """
+    SELECT COUNT(*) FROM slack_outbox WHERE status = 'pending'
+"""
+
+SELECT_IDEMPOTENT_RESPONSE_SQL = """
+    SELECT response, created_at FROM webhook_idempotency
+    WHERE idempotency_key = ? AND created_at >= ?
+"""
+
+INSERT_IDEMPOTENT_RESPONSE_SQL = """
+    INSERT OR REPLACE INTO webhook_idempotency (idempotency_key, response, created_at)
+    VALUES (?, ?, ?)
+"""
+
+PRUNE_IDEMPOTENT_RESPONSES_SQL = """
+    DELETE FROM webhook_idempotency WHERE created_at < ?
+"""
+
+INSERT_REPLY_SQL = """
+    INSERT OR IGNORE INTO pending_replies
+    (message_id, kind, target, username, text, account, next_attempt_at, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SELECT_DUE_REPLIES_SQL = """
+    SELECT id, message_id, kind, target, username, text, attempts
+    FROM pending_replies
+    WHERE status = 'pending' AND account = ? AND kind = ? AND next_attempt_at <= ?
+    ORDER BY next_attempt_at, id
+    LIMIT ?
+"""
+
+LEASE_REPLY_SQL = """
+    UPDATE pending_replies SET next_attempt_at = ? WHERE id = ?
+"""
+
+MARK_REPLY_SENT_SQL = """
+    UPDATE pending_replies
+    SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL
+    WHERE id = ?
+"""
+
+MARK_REPLY_FAILED_SQL = """
+    UPDATE pending_replies
+    SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+    WHERE id = ?
+"""
+
+SELECT_NEXT_REPLY_DUE_SQL = """
+    SELECT MIN(next_attempt_at) FROM pending_replies
+    WHERE status = 'pending' AND account = ? AND kind = ?
+"""
+
+COUNT_PENDING_REPLIES_SQL = """
+    SELECT COUNT(*) FROM pending_replies WHERE status = 'pending'
+"""
+
+# Final-state rows older than a cutoff, deleted a batch at a time by
+# retention.py. A ledger row is only dropped once its reply is settled.
+PRUNE_FINISHED_REPLIES_SQL = """
+    DELETE FROM pending_replies WHERE id IN (
+        SELECT id FROM pending_replies
+        WHERE status IN ('sent', 'dead') AND created_at < ?
+        LIMIT ?
+    )
+"""
+
+PRUNE_FINISHED_ESCALATIONS_SQL = """
+    DELETE FROM slack_outbox WHERE id IN (
+        SELECT id FROM slack_outbox
+        WHERE status IN ('delivered', 'dead') AND created_at < ?
+        LIMIT ?
+    )
+"""
+
+PRUNE_PROCESSED_SQL = """
+    DELETE FROM processed_messages WHERE message_id IN (
+        SELECT message_id FROM processed_messages
+        WHERE status IN ('replied', 'undeliverable') AND updated_at < ?
+          AND NOT EXISTS (
+              SELECT 1 FROM pending_replies
+              WHERE pending_replies.message_id = processed_messages.message_id
+                AND pending_replies.status = 'pending'
+          )
+        LIMIT ?
+    )
+"""
+
+# Ledger statuses that mean "do not run the pipeline for this message again".
+# "queued" has a reply waiting in pending_replies; "undeliverable" ran out
+# of send attempts, which must not re-run classification either.
+PROCESSED_STATUSES = ("replied", "queued", "undeliverable")
+
+# Intents whose message is quoted as the original complaint when escalating
+COMPLAINT_INTENTS = ("new_complaint", "has_ticket")
+
+# Queued writes whose first parameter is the username they change; a user
+# with any of these still queued is flushed before being loaded from disk
+USER_WRITES = (INSERT_CONVERSATION_SQL, UPSERT_USER_STATE_SQL, INCREMENT_ESCALATION_SQL)
+
+# User cache value for an original complaint that hasn't been looked up
+_NOT_LOADED = object()
+
+
+def _column_names(conn: sqlite3.Connection, table: str) -> List[str]:
+    """Return the column names of a table"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _migration_v1_base_tables(conn: sqlite3.Connection):
+    """Initial schema (databases created before versioning already have it)"""
+    # Create conversations table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            message TEXT NOT NULL,
+            intent TEXT NOT NULL,
+            response TEXT NOT NULL,
+            is_dm BOOLEAN NOT NULL,
+            ticket_number TEXT,
+            escalated BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Create user state table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_state (
+            username TEXT PRIMARY KEY,
+            last_intent TEXT,
+            ticket_number TEXT,
+            last_interaction TIMESTAMP,
+            escalation_count INTEGER DEFAULT 0
+        )
+    """)
+
+
+def _migration_v2_tweet_id_and_indexes(conn: sqlite3.Connection):
+    """Store the source tweet/DM id and index the history lookups"""
+    if "tweet_id" not in _column_names(conn, "conversations"):
+        conn.execute("ALTER TABLE conversations ADD COLUMN tweet_id TEXT")
+    
+    # Serves get_conversation_history: equality on username, then
+    # created_at (and the implicit rowid) in index order
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_username_created_at
+        ON conversations (username, created_at)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_ticket_number
+        ON conversations (ticket_number)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_tweet_id
+        ON conversations (tweet_id)
+    """)
+
+
+def _migration_v3_processed_ledger(conn: sqlite3.Connection):
+    """Ledger of handled tweets/DMs plus per-stream high-water marks"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            message_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stream_cursors (
+            stream TEXT PRIMARY KEY,
+            last_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+
+
+def _migration_v4_intent_cache(conn: sqlite3.Connection):
+    """Persistent tier of the intent classification cache"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS intent_cache (
+            cache_key TEXT PRIMARY KEY,
+            intent TEXT NOT NULL,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_intent_cache_created_at
+        ON intent_cache (created_at)
+    """)
+
+
+def _migration_v5_slack_outbox(conn: sqlite3.Connection):
+    """Durable outbox for Slack escalations (delivered at least once)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS slack_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            delivered_at REAL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_slack_outbox_status_due
+        ON slack_outbox (status, next_attempt_at)
+    """)
+
+
+def _migration_v6_webhook_idempotency(conn: sqlite3.Connection):
+    """Stored webhook responses keyed by client idempotency key"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_idempotency (
+            idempotency_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_webhook_idempotency_created_at
+        ON webhook_idempotency (created_at)
+    """)
+
+
+def _migration_v7_pending_replies(conn: sqlite3.Connection):
+    """Outbound replies decided by the pipeline but not yet sent"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pending_replies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            target TEXT NOT NULL,
+            username TEXT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pending_replies_status_due
+        ON pending_replies (status, next_attempt_at)
+    """)
+
+
+def _migration_v8_reply_accounts(conn: sqlite3.Connection):
+    """Tag queued replies with the account that must send them"""
+    if "account" not in _column_names(conn, "pending_replies"):
+        conn.execute("ALTER TABLE pending_replies ADD COLUMN account TEXT NOT NULL DEFAULT ''")
+    conn.execute("DROP INDEX IF EXISTS idx_pending_replies_status_due")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pending_replies_account_due
+        ON pending_replies (status, account, next_attempt_at)
+    """)
+
+
+# Ordered schema migrations; MIGRATIONS[n] upgrades user_version n -> n + 1.
+# Only ever append to this list.
+MIGRATIONS = [
+    _migration_v1_base_tables,
+    _migration_v2_tweet_id_and_indexes,
+    _migration_v3_processed_ledger,
+    _migration_v4_intent_cache,
+    _migration_v5_slack_outbox,
+    _migration_v6_webhook_idempotency,
+    _migration_v7_pending_replies,
+    _migration_v8_reply_accounts,
+]
+
+
+# Sentinel telling the write-behind thread to drain and exit
+_STOP_WRITER = object()
 
 
 class ConversationDB:
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, write_behind: bool = None, user_cache_size: int = None):
         self.db_path = db_path or config.DATABASE_PATH
+        self._lock = threading.RLock()
+        self._conn = None
+        self._write_queue = None
+        self._writer = None
         self._init_db()
+        
+        # Write-through LRU of username -> {"state", "original_complaint"}.
+        # Every write to a cached user updates its entry under the same lock
+        # that queues the write, so a hit is as fresh as the write path.
+        # Other processes (webhook server, supervisor workers, retention)
+        # write the same file, so the whole cache is dropped whenever
+        # PRAGMA data_version shows another connection has committed.
+        if user_cache_size is None:
+            user_cache_size = config.USER_STATE_CACHE_SIZE
+        self._user_cache_size = user_cache_size
+        self._user_cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+        self._data_version = None
+        self.user_cache_hits = 0
+        self.user_cache_misses = 0
+        self.user_cache_invalidations = 0
+        
+        # username -> user writes still in the write-behind queue
+        self._queued_user_writes: Dict[str, int] = {}
+        self._queued_user_writes_lock = threading.Lock()
+        
+        if write_behind is None:
+            write_behind = config.DATABASE_WRITE_BEHIND
+        if write_behind:
+            self._start_writer()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open the long-lived connection shared by all methods"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=config.DATABASE_STATEMENT_CACHE_SIZE
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    @contextmanager
+    def _transaction(self, immediate: bool = False):
+        """
+        Run statements in a single transaction on the shared connection
+        
+        Args:
+            immediate: Take the database write lock before the first
+                statement. sqlite3 only opens a transaction at the first
+                write, so a read-then-update (e.g. claiming outbox rows)
+                needs this to stop another process claiming the same rows.
+        """
+        with self._lock:
+            if immediate:
+                self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Run a read-only query on the shared connection"""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
     
     def _init_db(self):
         """Initialize database with required tables"""
         # Ensure data directory exists
-        import os
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create conversations table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                message TEXT NOT NULL,
-                intent TEXT NOT NULL,
-                response TEXT NOT NULL,
-                is_dm BOOLEAN NOT NULL,
-                ticket_number TEXT,
-                escalated BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Create user state table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_state (
-                username TEXT PRIMARY KEY,
-                last_intent TEXT,
-                ticket_number TEXT,
-                last_interaction TIMESTAMP,
-                escalation_count INTEGER DEFAULT 0
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = self._connect()
+        self._migrate()
+    
+    def _migrate(self):
+        """Bring the schema up to date, tracked via PRAGMA user_version"""
+        with self._lock:
+            conn = self._conn
+            # IMMEDIATE takes the write lock up front so concurrent processes
+            # opening the same file apply each migration exactly once
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                    migration(conn)
+                    conn.execute(f"PRAGMA user_version = {target}")
+                    logger.info(f"🗄️  Migrated database to schema v{target}", extra={"schema_version": target})
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def _start_writer(self):
+        """Start the background thread that group-commits queued writes"""
+        self._write_queue = queue.Queue(maxsize=config.DATABASE_WRITE_QUEUE_SIZE)
+        self._writer = threading.Thread(
+            target=self._writer_loop,
+            name="conversation-db-writer",
+            daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.close)
+    
+    def _write(self, sql: str, params: tuple):
+        """
+        Execute a write statement
+        
+        In write-behind mode the statement is queued for the background
+        writer; put() blocks when the queue is full, which is what applies
+        backpressure to callers during a burst.
+        """
+        write_queue = self._write_queue
+        if write_queue is not None:
+            if sql in USER_WRITES:
+                with self._queued_user_writes_lock:
+                    username = params[0]
+                    self._queued_user_writes[username] = self._queued_user_writes.get(username, 0) + 1
+            write_queue.put((sql, params))
+            return
+        
+        with self._transaction() as conn:
+            conn.execute(sql, params)
+    
+    def _writer_loop(self):
+        """Collect queued writes into batches of N rows or T milliseconds"""
+        batch_size = config.DATABASE_WRITE_BATCH_SIZE
+        interval = config.DATABASE_WRITE_BATCH_INTERVAL_MS / 1000
+        write_queue = self._write_queue
+        
+        while True:
+            item = write_queue.get()
+            if item is _STOP_WRITER:
+                write_queue.task_done()
+                return
+            
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = write_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP_WRITER:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            self._commit_batch(batch)
+            self._forget_queued_user_writes(batch)
+            for _ in batch:
+                write_queue.task_done()
+            
+            if stopping:
+                write_queue.task_done()
+                return
+    
+    def _commit_batch(self, batch: List[tuple]):
+        """Write a batch in one transaction, one executemany per statement run"""
+        try:
+            with self._transaction() as conn:
+                # Group consecutive writes of the same statement so ordering
+                # between e.g. an insert and a later update is preserved
+                for sql, ops in groupby(batch, key=lambda op: op[0]):
+                    conn.executemany(sql, [params for _, params in ops])
+        except sqlite3.Error as e:
+            logger.warning(
+                f"⚠️ Batch write of {len(batch)} rows failed ({e}), retrying one by one",
+                extra={"batch_size": len(batch), "error": str(e)}
             )
-        """)
+            for sql, params in batch:
+                try:
+                    with self._transaction() as conn:
+                        conn.execute(sql, params)
+                except sqlite3.Error as row_error:
+                    logger.error(f"❌ Dropped write: {row_error}", extra={"error": str(row_error)})
+    
+    def _forget_queued_user_writes(self, batch: List[tuple]):
+        """Drop committed (or dropped) user writes from the pending counts"""
+        with self._queued_user_writes_lock:
+            for sql, params in batch:
+                if sql not in USER_WRITES:
+                    continue
+                username = params[0]
+                remaining = self._queued_user_writes.get(username, 0) - 1
+                if remaining > 0:
+                    self._queued_user_writes[username] = remaining
+                else:
+                    self._queued_user_writes.pop(username, None)
+    
+    def _has_queued_user_writes(self, username: str) -> bool:
+        with self._queued_user_writes_lock:
+            return username in self._queued_user_writes
+    
+    def flush(self):
+        """Block until every queued write has been committed"""
+        if self._write_queue is not None:
+            self._write_queue.join()
+    
+    def close(self):
+        """Flush pending writes and close the shared connection"""
+        write_queue, writer = self._write_queue, self._writer
+        if write_queue is not None:
+            # Stop accepting queued writes before draining the backlog
+            self._write_queue = None
+            self._writer = None
+            write_queue.put(_STOP_WRITER)
+            writer.join()
         
-        conn.commit()
-        conn.close()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
     
     def save_conversation(
         self,
@@ -59,20 +695,18 @@ class ConversationDB:
         response: str,
         is_dm: bool = False,
         ticket_number: str = None,
-        escalated: bool = False
+        escalated: bool = False,
+        tweet_id: str = None
     ):
         """Save a conversation to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO conversations 
-            (username, message, intent, response, is_dm, ticket_number, escalated)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (username, message, intent, response, is_dm, ticket_number, escalated))
-        
-        conn.commit()
-        conn.close()
+        with self._user_cache_lock:
+            self._write(
+                INSERT_CONVERSATION_SQL,
+                (username, message, intent, response, is_dm, ticket_number, escalated, tweet_id)
+            )
+            entry = self._user_cache.get(username)
+            if entry is not None and intent in COMPLAINT_INTENTS:
+                entry["original_complaint"] = message
     
     def update_user_state(
         self,
@@ -81,70 +715,130 @@ class ConversationDB:
         ticket_number: str = None
     ):
         """Update user's conversation state"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT OR REPLACE INTO user_state 
-            (username, last_intent, ticket_number, last_interaction)
-            VALUES (?, ?, ?, ?)
-        """, (username, intent, ticket_number, datetime.now()))
-        
-        conn.commit()
-        conn.close()
+        now = datetime.now()
+        with self._user_cache_lock:
+            self._write(
+                UPSERT_USER_STATE_SQL,
+                (username, intent, ticket_number, now)
+            )
+            entry = self._user_cache.get(username)
+            if entry is not None:
+                state = entry["state"] or self._new_user_state()
+                state["last_intent"] = intent
+                state["ticket_number"] = ticket_number
+                # As read back through sqlite3's datetime adapter
+                state["last_interaction"] = now.isoformat(" ")
+                entry["state"] = state
     
     def get_user_state(self, username: str) -> Optional[Dict]:
-        """Get user's current state"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """
+        Get user's current state
+        
+        Served from the user cache when the user was seen recently.
+        """
+        with self._user_cache_lock:
+            state = self._user_entry(username)["state"]
+            return dict(state) if state is not None else None
+    
+    def increment_escalation(self, username: str):
+        """Increment escalation count for user"""
+        with self._user_cache_lock:
+            self._write(INCREMENT_ESCALATION_SQL, (username,))
+            entry = self._user_cache.get(username)
+            if entry is not None:
+                state = entry["state"] or self._new_user_state()
+                state["escalation_count"] += 1
+                entry["state"] = state
+    
+    def get_original_complaint(self, username: str) -> Optional[str]:
+        """
+        The user's most recent new_complaint/has_ticket message, quoted
+        when escalating their ticket
+        """
+        with self._user_cache_lock:
+            entry = self._user_entry(username)
+            if entry["original_complaint"] is _NOT_LOADED:
+                rows = self._query(SELECT_ORIGINAL_COMPLAINT_SQL, (username,))
+                entry["original_complaint"] = rows[0][0] if rows else None
+            return entry["original_complaint"]
+    
+    def _new_user_state(self) -> Dict:
+        """State of a user_state row created by an update"""
+        return {
+            "last_intent": None,
+            "ticket_number": None,
+            "last_interaction": None,
+            "escalation_count": 0
+        }
+    
+    def _user_entry(self, username: str) -> Dict:
+        """
+        Get a user's cache entry, loading it on a miss (cache lock held)
         
-        cursor.execute("""
-            SELECT last_intent, ticket_number, last_interaction, escalation_count
-            FROM user_state
-            WHERE username = ?
-        """, (username,))
+        With the cache disabled the entry is loaded and not kept.
+        """
+        self._drop_stale_user_cache()
+        entry = self._user_cache.get(username)
+        if entry is not None:
+            self._user_cache.move_to_end(username)
+            self.user_cache_hits += 1
+            return entry
         
-        row = cursor.fetchone()
-        conn.close()
+        self.user_cache_misses += 1
+        # Writes for this user may still be queued; make them visible first
+        if self._has_queued_user_writes(username):
+            self.flush()
         
-        if row:
-            return {
+        rows = self._query(SELECT_USER_STATE_SQL, (username,))
+        state = None
+        if rows:
+            row = rows[0]
+            state = {
                 "last_intent": row[0],
                 "ticket_number": row[1],
                 "last_interaction": row[2],
                 "escalation_count": row[3]
             }
-        return None
-    
-    def increment_escalation(self, username: str):
-        """Increment escalation count for user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        entry = {"state": state, "original_complaint": _NOT_LOADED}
         
-        cursor.execute("""
-            UPDATE user_state
-            SET escalation_count = escalation_count + 1
-            WHERE username = ?
-        """, (username,))
+        if self._user_cache_size > 0:
+            self._user_cache[username] = entry
+            while len(self._user_cache) > self._user_cache_size:
+                self._user_cache.popitem(last=False)
+        return entry
+    
+    def _drop_stale_user_cache(self):
+        """
+        Empty the user cache if another connection committed since the
+        last check (cache lock held)
         
-        conn.commit()
-        conn.close()
+        data_version only changes for commits made through other
+        connections, so this process's own writes keep the cache warm.
+        """
+        version = self._query("PRAGMA data_version")[0][0]
+        if version == self._data_version:
+            return
+        if self._data_version is not None and self._user_cache:
+            self._user_cache.clear()
+            self.user_cache_invalidations += 1
+        self._data_version = version
+    
+    def user_cache_stats(self) -> Dict:
+        """Size and hit counters of the user cache"""
+        with self._user_cache_lock:
+            return {
+                "size": len(self._user_cache),
+                "hits": self.user_cache_hits,
+                "misses": self.user_cache_misses,
+                "invalidations": self.user_cache_invalidations
+            }
     
     def get_conversation_history(self, username: str, limit: int = 10) -> List[Dict]:
         """Get recent conversation history for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # History feeds escalations, so make sure queued rows are visible
+        self.flush()
         
-        cursor.execute("""
-            SELECT message, intent, response, is_dm, ticket_number, created_at
-            FROM conversations
-            WHERE username = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-        """, (username, limit))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        rows = self._query(SELECT_HISTORY_SQL, (username, limit))
         
         return [
             {
@@ -157,7 +851,379 @@ class ConversationDB:
             }
             for row in rows
         ]
+    
+    def processed_ids(self, message_ids: List[str]) -> Set[str]:
+        """
+        Check the ledger for tweets/DMs that have already been handled
+        
+        One query for a whole poll; the IDs are passed as a JSON array so
+        the statement text stays constant.
+        
+        Returns:
+            The subset of message_ids not to process again
+        """
+        if not message_ids:
+            return set()
+        rows = self._query(SELECT_PROCESSED_STATUSES_SQL, (json.dumps(list(message_ids)),))
+        return {message_id for message_id, status in rows if status in PROCESSED_STATUSES}
+    
+    def get_cursor(self, stream: str) -> Optional[str]:
+        """Get the newest fully processed message ID for a stream"""
+        rows = self._query(SELECT_CURSOR_SQL, (stream,))
+        return rows[0][0] if rows else None
+    
+    def advance_cursor(self, stream: str, last_id: str):
+        """Move a stream's high-water mark forward (never backwards)"""
+        with self._transaction() as conn:
+            conn.execute(ADVANCE_CURSOR_SQL, (stream, last_id))
+    
+    def set_cursor(self, stream: str, value: str):
+        """Overwrite a stream position, in either direction"""
+        with self._transaction() as conn:
+            conn.execute(SET_CURSOR_SQL, (stream, value))
+    
+    def clear_cursor(self, stream: str):
+        """Forget a stream position"""
+        with self._transaction() as conn:
+            conn.execute(DELETE_CURSOR_SQL, (stream,))
+    
+    def get_cached_intent(self, cache_key: str, min_created_at: float) -> Optional[tuple]:
+        """
+        Get a cached classification newer than min_created_at
+        
+        Returns:
+            (intent, created_at) or None
+        """
+        rows = self._query(SELECT_CACHED_INTENT_SQL, (cache_key, min_created_at))
+        return rows[0] if rows else None
+    
+    def put_cached_intent(self, cache_key: str, intent: str, created_at: float):
+        """Store a classification in the persistent cache tier"""
+        self._write(UPSERT_CACHED_INTENT_SQL, (cache_key, intent, created_at))
+    
+    def prune_intent_cache(self, before: float):
+        """Delete cached classifications older than `before`"""
+        self._write(PRUNE_INTENT_CACHE_SQL, (before,))
+    
+    def enqueue_escalation(self, escalation: Dict) -> int:
+        """
+        Add an escalation to the Slack outbox
+        
+        Committed synchronously, even in write-behind mode, so an accepted
+        escalation survives a crash.
+        
+        Returns:
+            Outbox row ID
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                INSERT_ESCALATION_SQL,
+                (json.dumps(escalation), now, now)
+            )
+            return cursor.lastrowid
+    
+    def claim_due_escalations(self, limit: int, lease: float) -> List[Dict]:
+        """
+        Claim pending escalations that are due for delivery
+        
+        Claimed rows are pushed `lease` seconds into the future, so another
+        worker (or this one after a crash) only retries them once the lease
+        runs out. The select and the lease share one IMMEDIATE transaction,
+        so dispatchers in different processes never claim the same row.
+        
+        Returns:
+            List of dicts with id, escalation, attempts and created_at
+        """
+        now = time.time()
+        with self._transaction(immediate=True) as conn:
+            rows = conn.execute(SELECT_DUE_ESCALATIONS_SQL, (now, limit)).fetchall()
+            conn.executemany(LEASE_ESCALATION_SQL, [(now + lease, row[0]) for row in rows])
+        
+        return [
+            {
+                "id": row[0],
+                "escalation": json.loads(row[1]),
+                "attempts": row[2],
+                "created_at": row[3]
+            }
+            for row in rows
+        ]
+    
+    def mark_escalations_delivered(self, outbox_ids: List[int]):
+        """Mark outbox rows as delivered"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                MARK_ESCALATION_DELIVERED_SQL,
+                [(now, outbox_id) for outbox_id in outbox_ids]
+            )
+    
+    def mark_escalations_failed(
+        self,
+        outbox_ids: List[int],
+        error: str,
+        next_attempt_at: float = None
+    ):
+        """
+        Record a failed delivery attempt
+        
+        Args:
+            outbox_ids: Outbox rows that failed together
+            error: Error description
+            next_attempt_at: When to retry; None gives up (status "dead")
+        """
+        status = "pending" if next_attempt_at is not None else "dead"
+        with self._transaction() as conn:
+            conn.executemany(
+                MARK_ESCALATION_FAILED_SQL,
+                [(status, next_attempt_at or 0, error, outbox_id) for outbox_id in outbox_ids]
+            )
+    
+    def defer_escalations(self, outbox_ids: List[int], next_attempt_at: float):
+        """Push claimed rows back without counting an attempt (e.g. rate limited)"""
+        with self._transaction() as conn:
+            conn.executemany(
+                LEASE_ESCALATION_SQL,
+                [(next_attempt_at, outbox_id) for outbox_id in outbox_ids]
+            )
+    
+    def next_escalation_due(self) -> Optional[float]:
+        """Timestamp of the earliest pending escalation, if any"""
+        return self._query(SELECT_NEXT_ESCALATION_DUE_SQL)[0][0]
+    
+    def count_pending_escalations(self) -> int:
+        """Number of escalations waiting in the outbox"""
+        return self._query(COUNT_PENDING_ESCALATIONS_SQL)[0][0]
+    
+    def get_idempotent_response(self, key: str, min_created_at: float) -> Optional[tuple]:
+        """
+        Get a stored webhook response newer than min_created_at
+        
+        Returns:
+            (response dict, created_at) or None
+        """
+        rows = self._query(SELECT_IDEMPOTENT_RESPONSE_SQL, (key, min_created_at))
+        if not rows:
+            return None
+        return json.loads(rows[0][0]), rows[0][1]
+    
+    def save_idempotent_response(self, key: str, response: Dict, created_at: float):
+        """Store a webhook response (committed synchronously)"""
+        with self._transaction() as conn:
+            conn.execute(
+                INSERT_IDEMPOTENT_RESPONSE_SQL,
+                (key, json.dumps(response), created_at)
+            )
+    
+    def prune_idempotent_responses(self, before: float):
+        """Delete stored webhook responses older than `before`"""
+        self._write(PRUNE_IDEMPOTENT_RESPONSES_SQL, (before,))
+    
+    def enqueue_reply(
+        self,
+        message_id: str,
+        kind: str,
+        target: str,
+        text: str,
+        username: str = None,
+        account: str = ""
+    ) -> int:
+        """
+        Queue an outbound reply and mark its message as queued
+        
+        Both happen in one transaction, so after a crash a message is either
+        re-processed from scratch or has exactly one pending reply.
+        
+        Args:
+            message_id: Tweet/DM being answered
+            kind: "mention" or "dm"
+            target: Tweet ID to reply to, or user ID to DM
+            text: Reply text
+            username: Recipient's username, for logging
+            account: Support account that must send the reply ("" when
+                running a single account)
+        
+        Returns:
+            Number of rows queued (0 if a reply already exists)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                INSERT_REPLY_SQL,
+                (message_id, kind, target, username, text, account, now, now)
+            )
+            conn.execute(UPSERT_PROCESSED_SQL, (message_id, kind, "queued"))
+            return cursor.rowcount
+    
+    def claim_due_replies(self, limit: int, lease: float, kind: str, account: str = "") -> List[Dict]:
+        """
+        Claim an account's due replies of one kind, leasing them for
+        `lease` seconds
+        
+        The select and the lease share one IMMEDIATE transaction, so two
+        senders never claim (and send) the same reply.
+        
+        Returns:
+            List of reply dicts
+        """
+        now = time.time()
+        with self._transaction(immediate=True) as conn:
+            rows = conn.execute(SELECT_DUE_REPLIES_SQL, (account, kind, now, limit)).fetchall()
+            conn.executemany(LEASE_REPLY_SQL, [(now + lease, row[0]) for row in rows])
+        
+        return [
+            {
+                "id": row[0],
+                "message_id": row[1],
+                "kind": row[2],
+                "target": row[3],
+                "username": row[4],
+                "text": row[5],
+                "attempts": row[6]
+            }
+            for row in rows
+        ]
+    
+    def mark_reply_sent(self, reply_id: int, message_id: str, kind: str):
+        """Record a sent reply and mark its message as replied"""
+        with self._transaction() as conn:
+            conn.execute(MARK_REPLY_SENT_SQL, (time.time(), reply_id))
+            conn.execute(UPSERT_PROCESSED_SQL, (message_id, kind, "replied"))
+    
+    def mark_reply_failed(
+        self,
+        reply_id: int,
+        message_id: str,
+        kind: str,
+        error: str,
+        next_attempt_at: float = None
+    ):
+        """
+        Record a failed send
+        
+        Args:
+            next_attempt_at: When to retry; None gives up (status "dead")
+        """
+        with self._transaction() as conn:
+            if next_attempt_at is not None:
+                conn.execute(MARK_REPLY_FAILED_SQL, ("pending", next_attempt_at, error, reply_id))
+            else:
+                conn.execute(MARK_REPLY_FAILED_SQL, ("dead", 0, error, reply_id))
+                conn.execute(UPSERT_PROCESSED_SQL, (message_id, kind, "undeliverable"))
+    
+    def defer_reply(self, reply_id: int, next_attempt_at: float):
+        """Push a reply back without counting an attempt (e.g. rate limited)"""
+        with self._transaction() as conn:
+            conn.execute(LEASE_REPLY_SQL, (next_attempt_at, reply_id))
+    
+    def next_reply_due(self, kind: str, account: str = "") -> Optional[float]:
+        """Timestamp of an account's earliest pending reply of one kind, if any"""
+        return self._query(SELECT_NEXT_REPLY_DUE_SQL, (account, kind))[0][0]
+    
+    def count_pending_replies(self) -> int:
+        """Number of replies waiting to be sent"""
+        return self._query(COUNT_PENDING_REPLIES_SQL)[0][0]
+    
+    def conversations_after(self, after_id: int, limit: int) -> List[Dict]:
+        """Conversation rows with id > after_id, oldest first (for archiving)"""
+        self.flush()
+        rows = self._query(SELECT_CONVERSATIONS_AFTER_SQL, (after_id, limit))
+        return [
+            {
+                "id": row[0],
+                "username": row[1],
+                "message": row[2],
+                "intent": row[3],
+                "response": row[4],
+                "is_dm": bool(row[5]),
+                "ticket_number": row[6],
+                "escalated": bool(row[7]),
+                "tweet_id": row[8],
+                "created_at": row[9]
+            }
+            for row in rows
+        ]
+    
+    def delete_conversations(self, after_id: int, through_id: int) -> int:
+        """Delete conversations with after_id < id <= through_id in one short transaction"""
+        with self._transaction() as conn:
+            return conn.execute(DELETE_CONVERSATIONS_RANGE_SQL, (after_id, through_id)).rowcount
+    
+    def prune_finished_replies(self, before: float, limit: int) -> int:
+        """Delete up to `limit` sent/dead replies created before `before`"""
+        with self._transaction() as conn:
+            return conn.execute(PRUNE_FINISHED_REPLIES_SQL, (before, limit)).rowcount
+    
+    def prune_finished_escalations(self, before: float, limit: int) -> int:
+        """Delete up to `limit` delivered/dead escalations created before `before`"""
+        with self._transaction() as conn:
+            return conn.execute(PRUNE_FINISHED_ESCALATIONS_SQL, (before, limit)).rowcount
+    
+    def prune_processed(self, before: str, limit: int) -> int:
+        """Delete up to `limit` settled ledger rows updated before `before` (UTC text)"""
+        with self._transaction() as conn:
+            return conn.execute(PRUNE_PROCESSED_SQL, (before, limit)).rowcount
+    
+    def incremental_vacuum(self, pages: int) -> int:
+        """
+        Return up to `pages` free pages to the filesystem
+        
+        Returns:
+            Free pages still left in the file
+        """
+        with self._lock:
+            # Each freed page is a result row; the pragma only runs as they are stepped
+            self._conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            self._conn.commit()
+            return self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+    
+    def auto_vacuum_mode(self) -> int:
+        """PRAGMA auto_vacuum: 0 none, 1 full, 2 incremental"""
+        return self._query("PRAGMA auto_vacuum")[0][0]
+    
+    def enable_incremental_vacuum(self):
+        """
+        Switch an existing file to auto_vacuum = INCREMENTAL
+        
+        Needs a full VACUUM, which rewrites the file and blocks every
+        writer while it runs; only needed once for databases created
+        before incremental vacuum was enabled.
+        """
+        self.flush()
+        with self._lock:
+            self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._conn.execute("VACUUM")
+    
+    def checkpoint(self):
+        """Copy the WAL into the database file and truncate it"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+# Shared store, created on first use by get_db()
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db() -> ConversationDB:
+    """
+    Get the shared conversation store
+    
+    Opening it creates the data directory and applies pending migrations,
+    so it only happens when something first touches the database rather
+    than whenever a module imports this one.
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = ConversationDB()
+    return _db
 
 
-# Global instance
-db = ConversationDB()
+def __getattr__(name: str):
+    # `from database import db` keeps working; it opens the store at that point
+    if name == "db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,32 @@
 """
 Gemini AI Integration for Intent Classification and Response Generation
 """
-import google.generativeai as genai
+import asyncio
+import json
 import random
+import re
+import threading
+from typing import List, Optional, Tuple
 import config
+from intent_cache import intent_cache
+from logging_setup import get_logger
+from metrics import classification_fallbacks_total, stage_seconds
 
-# Configure Gemini
-if config.GEMINI_API_KEY:
-    genai.configure(api_key=config.GEMINI_API_KEY)
+logger = get_logger(__name__)
+
+# Keyword tables for the fallback classifier, compiled once at import.
+# Credentials outrank a ticket number; the remaining rules are checked in order.
+_CREDENTIAL_KEYWORDS = ("password", "login", "credentials", "@gmail", "@yahoo")
+_KEYWORD_RULES = (
+    ("has_ticket", ("ticket", "raised", "created", "submitted")),
+    ("follow_up", ("update", "status", "still waiting", "when", "how long")),
+    ("general_question", ("how to", "what is", "can i", "does mudrex")),
+)
+_TICKET_RE = re.compile(config.TICKET_PATTERN)
+
+# Shared model, created on first use by get_model()
+_model = None
+_model_lock = threading.Lock()
 
 # Intent classification prompt
 INTENT_CLASSIFICATION_PROMPT = """
@@ -27,6 +46,31 @@ Is DM: {is_dm}
 Response format: Just return the category name, nothing else.
 """
 
+# Batch classification prompt (several messages in one round trip)
+BATCH_CLASSIFICATION_PROMPT = """
+You are analyzing Twitter messages sent to @MudrexHelp (a crypto trading platform support handle).
+
+Classify the intent of EACH message into ONE of these categories:
+1. new_complaint - User is complaining for the first time (hasn't mentioned raising a ticket)
+2. has_ticket - User mentions they have already raised/created a support ticket
+3. dm_ticket_shared - User is sharing a ticket number in DM (format: #12345)
+4. follow_up - User is following up, asking for updates, or being impatient
+5. credentials_shared - User shared email, password, or sensitive info publicly
+6. general_question - User asking general questions about Mudrex features/products
+
+Messages (JSON array, "is_dm" tells whether it is a direct message):
+{messages}
+
+Response format: a JSON array with one object per message, for example
+[{{"id": 0, "intent": "new_complaint"}}, {{"id": 1, "intent": "follow_up"}}]
+Return only the JSON array, nothing else.
+"""
+
+VALID_INTENTS = [
+    "new_complaint", "has_ticket", "dm_ticket_shared",
+    "follow_up", "credentials_shared", "general_question"
+]
+
 # Response generation prompt
 RESPONSE_GENERATION_PROMPT = """
 You are a helpful but limited support assistant for @MudrexHelp on Twitter.
@@ -46,6 +90,61 @@ Generate a response that sounds human and empathetic. Don't use phrases like "I'
 """
 
 
+def get_model():
+    """
+    Get the shared Gemini model
+    
+    The model is built once per process; the SDK keeps its API clients (and
+    their connections) alive, so every call after the first reuses them.
+    The SDK itself is imported here too: it takes longer to import than the
+    rest of the bot, and keyword-fallback-only processes never need it.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=config.GEMINI_API_KEY)
+                _model = genai.GenerativeModel(config.GEMINI_MODEL)
+    return _model
+
+
+def _request_options() -> dict:
+    """Per-request options passed to every Gemini call"""
+    return {"timeout": config.GEMINI_TIMEOUT}
+
+
+def _classification_prompt(message: str, is_dm: bool) -> str:
+    """Render the single-message classification prompt"""
+    return INTENT_CLASSIFICATION_PROMPT.format(
+        message=message,
+        is_dm=is_dm
+    )
+
+
+def _cached_intent(message: str, is_dm: bool) -> Optional[str]:
+    """Look a message up in the intent cache, if enabled"""
+    if intent_cache is None:
+        return None
+    return intent_cache.get(message, is_dm)
+
+
+async def _cached_intent_async(message: str, is_dm: bool) -> Optional[str]:
+    """_cached_intent without blocking the event loop on SQLite"""
+    if intent_cache is None:
+        return None
+    return await intent_cache.get_async(message, is_dm)
+
+
+def _validated_intent(text: str) -> Optional[str]:
+    """A single-message Gemini answer, or None if it isn't a known intent"""
+    intent = text.strip().lower()
+    if intent not in VALID_INTENTS:
+        classification_fallbacks_total.inc(reason="invalid_intent")
+        return None
+    return intent
+
+
 def classify_intent(message: str, is_dm: bool = False) -> str:
     """
     Classify the intent of a Twitter message using Gemini
@@ -59,33 +158,244 @@ def classify_intent(message: str, is_dm: bool = False) -> str:
     """
     if not config.GEMINI_API_KEY:
         # Fallback to basic keyword matching for testing
+        classification_fallbacks_total.inc(reason="no_api_key")
         return _fallback_classify(message, is_dm)
     
+    # Repeated messages ("any update?") skip the LLM round trip
+    cached = _cached_intent(message, is_dm)
+    if cached is not None:
+        return cached
+    
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        prompt = INTENT_CLASSIFICATION_PROMPT.format(
-            message=message,
-            is_dm=is_dm
-        )
-        response = model.generate_content(prompt)
-        intent = response.text.strip().lower()
-        
-        # Validate intent
-        valid_intents = [
-            "new_complaint", "has_ticket", "dm_ticket_shared",
-            "follow_up", "credentials_shared", "general_question"
-        ]
-        
-        if intent in valid_intents:
-            return intent
-        else:
+        with stage_seconds.time(stage="classify"):
+            response = get_model().generate_content(
+                _classification_prompt(message, is_dm),
+                request_options=_request_options()
+            )
+        intent = _validated_intent(response.text)
+        if intent is None:
             return "new_complaint"  # Default fallback
+        if intent_cache is not None:
+            intent_cache.put(message, is_dm, intent)
+        return intent
             
     except Exception as e:
-        print(f"Error in Gemini classification: {e}")
+        logger.warning(f"Error in Gemini classification: {e}", extra={"error": str(e)})
+        classification_fallbacks_total.inc(reason="error")
+        return _fallback_classify(message, is_dm)
+
+
+def classify_message(message: str, is_dm: bool = False) -> Tuple[str, Optional[str]]:
+    """
+    classify_intent plus the message's ticket number
+    
+    Without a Gemini key both come from a single scan_message pass.
+    
+    Returns:
+        (intent, ticket number without # or None)
+    """
+    if not config.GEMINI_API_KEY:
+        classification_fallbacks_total.inc(reason="no_api_key")
+        return scan_message(message, is_dm)
+    return classify_intent(message, is_dm), extract_ticket_number(message)
+
+
+async def classify_intent_async(message: str, is_dm: bool = False) -> str:
+    """
+    Async version of classify_intent for the monitor and webhook server
+    
+    Uses the SDK's async generation path, so awaiting it neither blocks
+    the event loop nor ties up a worker thread; intent cache reads and
+    writes that reach SQLite run in the default executor.
+    
+    Args:
+        message: The tweet/DM content
+        is_dm: Whether this is a direct message
+    
+    Returns:
+        Intent category as string
+    """
+    if not config.GEMINI_API_KEY:
+        classification_fallbacks_total.inc(reason="no_api_key")
+        return _fallback_classify(message, is_dm)
+    
+    cached = await _cached_intent_async(message, is_dm)
+    if cached is not None:
+        return cached
+    
+    try:
+        with stage_seconds.time(stage="classify"):
+            response = await get_model().generate_content_async(
+                _classification_prompt(message, is_dm),
+                request_options=_request_options()
+            )
+        intent = _validated_intent(response.text)
+        if intent is None:
+            return "new_complaint"  # Default fallback
+        if intent_cache is not None:
+            await intent_cache.put_async(message, is_dm, intent)
+        return intent
+    
+    except Exception as e:
+        logger.warning(f"Error in Gemini classification: {e}", extra={"error": str(e)})
+        classification_fallbacks_total.inc(reason="error")
         return _fallback_classify(message, is_dm)
 
 
+def classify_intents_batch(messages: List[Tuple[str, bool]]) -> List[str]:
+    """
+    Classify many messages with as few Gemini calls as possible
+    
+    Cached messages are answered from the intent cache; the rest are sent
+    GEMINI_BATCH_SIZE at a time in one structured prompt. Items the model
+    leaves out or labels with an unknown intent, and whole batches whose
+    response can't be parsed, fall back to keyword classification.
+    
+    Args:
+        messages: List of (message, is_dm) tuples
+    
+    Returns:
+        Intent per message, in input order
+    """
+    if not config.GEMINI_API_KEY:
+        classification_fallbacks_total.inc(len(messages), reason="no_api_key")
+        return [_fallback_classify(message, is_dm) for message, is_dm in messages]
+    
+    intents = [_cached_intent(message, is_dm) for message, is_dm in messages]
+    for chunk in _uncached_chunks(intents):
+        try:
+            with stage_seconds.time(stage="classify_batch"):
+                response = get_model().generate_content(
+                    _build_batch_prompt(messages, chunk),
+                    request_options=_request_options()
+                )
+            labels = _parse_batch_response(response.text, len(chunk))
+        except Exception as e:
+            logger.warning(f"Error in Gemini batch classification: {e}", extra={"error": str(e), "batch_size": len(chunk)})
+            labels = [None] * len(chunk)
+        for message, is_dm, label in _apply_batch_labels(messages, intents, chunk, labels):
+            intent_cache.put(message, is_dm, label)
+    
+    return intents
+
+
+async def classify_intents_batch_async(messages: List[Tuple[str, bool]]) -> List[str]:
+    """
+    Async version of classify_intents_batch; chunks are sent concurrently
+    
+    Args:
+        messages: List of (message, is_dm) tuples
+    
+    Returns:
+        Intent per message, in input order
+    """
+    if not config.GEMINI_API_KEY:
+        classification_fallbacks_total.inc(len(messages), reason="no_api_key")
+        return [_fallback_classify(message, is_dm) for message, is_dm in messages]
+    
+    intents = list(await asyncio.gather(
+        *(_cached_intent_async(message, is_dm) for message, is_dm in messages)
+    ))
+    chunks = _uncached_chunks(intents)
+    
+    async def classify_chunk(chunk: List[int]) -> List[Optional[str]]:
+        try:
+            with stage_seconds.time(stage="classify_batch"):
+                response = await get_model().generate_content_async(
+                    _build_batch_prompt(messages, chunk),
+                    request_options=_request_options()
+                )
+            return _parse_batch_response(response.text, len(chunk))
+        except Exception as e:
+            logger.warning(f"Error in Gemini batch classification: {e}", extra={"error": str(e), "batch_size": len(chunk)})
+            return [None] * len(chunk)
+    
+    all_labels = await asyncio.gather(*(classify_chunk(chunk) for chunk in chunks))
+    fresh = []
+    for chunk, labels in zip(chunks, all_labels):
+        fresh.extend(_apply_batch_labels(messages, intents, chunk, labels))
+    await asyncio.gather(*(intent_cache.put_async(message, is_dm, label) for message, is_dm, label in fresh))
+    
+    return intents
+
+
+def _uncached_chunks(intents: List[Optional[str]]) -> List[List[int]]:
+    """Indexes the cache couldn't answer, GEMINI_BATCH_SIZE per chunk"""
+    misses = [index for index, intent in enumerate(intents) if intent is None]
+    batch_size = max(1, config.GEMINI_BATCH_SIZE)
+    return [misses[start:start + batch_size] for start in range(0, len(misses), batch_size)]
+
+
+def _apply_batch_labels(
+    messages: List[Tuple[str, bool]],
+    intents: List[Optional[str]],
+    chunk: List[int],
+    labels: List[Optional[str]]
+) -> List[Tuple[str, bool, str]]:
+    """
+    Fill in a chunk's labels, falling back per item
+    
+    Returns:
+        (message, is_dm, intent) for each label worth caching (none when
+        the cache is disabled)
+    """
+    fresh = []
+    for index, label in zip(chunk, labels):
+        message, is_dm = messages[index]
+        if label is None:
+            classification_fallbacks_total.inc(reason="batch_item")
+            intents[index] = _fallback_classify(message, is_dm)
+        else:
+            intents[index] = label
+            if intent_cache is not None:
+                fresh.append((message, is_dm, label))
+    return fresh
+
+
+def _build_batch_prompt(messages: List[Tuple[str, bool]], indexes: List[int]) -> str:
+    """Render the batch prompt; ids are positions within the chunk"""
+    payload = [
+        {"id": position, "message": messages[index][0], "is_dm": messages[index][1]}
+        for position, index in enumerate(indexes)
+    ]
+    return BATCH_CLASSIFICATION_PROMPT.format(
+        messages=json.dumps(payload, ensure_ascii=False, indent=1)
+    )
+
+
+def _parse_batch_response(text: str, count: int) -> List[Optional[str]]:
+    """
+    Parse a batch classification response
+    
+    Returns:
+        Validated intent per chunk position, None where missing or invalid
+    
+    Raises:
+        ValueError: If the response is not a JSON array of objects
+    """
+    text = text.strip()
+    
+    # Models like to wrap JSON in a markdown code fence
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.lower().startswith("json"):
+            text = text[4:]
+    
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("Batch response is not a JSON array")
+    
+    labels: List[Optional[str]] = [None] * count
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("Batch response item is not an object")
+        position = item.get("id")
+        intent = str(item.get("intent", "")).strip().lower()
+        if isinstance(position, int) and 0 <= position < count and intent in VALID_INTENTS:
+            labels[position] = intent
+    return labels
+
+
 def generate_response(intent: str, message: str = "", ticket_number: str = None) -> str:
     """
     Generate a response based on intent
@@ -116,33 +426,42 @@ def _fallback_classify(message: str, is_dm: bool) -> str:
     """
     Simple keyword-based classification when Gemini is not available
     """
+    intent, _ = scan_message(message, is_dm)
+    return intent
+
+
+def scan_message(message: str, is_dm: bool = False) -> Tuple[str, Optional[str]]:
+    """
+    Keyword-classify a message and extract its ticket number in one call
+    
+    Args:
+        message: The message text
+        is_dm: Whether this is a direct message
+    
+    Returns:
+        (intent, ticket number without # or None)
+    """
     message_lower = message.lower()
+    match = _TICKET_RE.search(message)
+    ticket_number = match.group(1) if match else None
     
     # Check for credentials
-    if any(word in message_lower for word in ["password", "login", "credentials", "@gmail", "@yahoo"]):
-        return "credentials_shared"
+    for keyword in _CREDENTIAL_KEYWORDS:
+        if keyword in message_lower:
+            return "credentials_shared", ticket_number
     
     # Check for ticket mention
-    import re
-    if re.search(config.TICKET_PATTERN, message):
-        if is_dm:
-            return "dm_ticket_shared"
-        else:
-            return "has_ticket"
-    
-    if any(word in message_lower for word in ["ticket", "raised", "created", "submitted"]):
-        return "has_ticket"
-    
-    # Check for follow-up
-    if any(word in message_lower for word in ["update", "status", "still waiting", "when", "how long"]):
-        return "follow_up"
+    if match:
+        return ("dm_ticket_shared" if is_dm else "has_ticket"), ticket_number
     
-    # Check for questions
-    if any(word in message_lower for word in ["how to", "what is", "can i", "does mudrex"]):
-        return "general_question"
+    # Ticket words, then follow-ups, then questions
+    for intent, keywords in _KEYWORD_RULES:
+        for keyword in keywords:
+            if keyword in message_lower:
+                return intent, ticket_number
     
     # Default to new complaint
-    return "new_complaint"
+    return "new_complaint", ticket_number
 
 
 def extract_ticket_number(message: str) -> str:
@@ -155,8 +474,7 @@ def extract_ticket_number(message: str) -> str:
     Returns:
         Ticket number without # or None
     """
-    import re
-    match = re.search(config.TICKET_PATTERN, message)
+    match = _TICKET_RE.search(message)
     if match:
         return match.group(1)  # Returns just the digits
     return None
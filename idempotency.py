@@ -0,0 +1,166 @@
+"""
+Idempotency-key handling for the webhook server
+Bounded TTL cache in front of a persistent table, with in-flight collapsing
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import config
+
+
+# How often expired rows are purged from the persistent table
+_PRUNE_INTERVAL = 3600
+
+
+class IdempotencyStore:
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, store=None):
+        """
+        Initialize the idempotency store
+        
+        Args:
+            max_size: Maximum responses kept in memory
+            ttl: Seconds a stored response is replayed for
+            store: Object providing get/save_idempotent_response
+                   (defaults to the global ConversationDB)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._store = store
+        self._entries: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._last_prune = time.time()
+        
+        # Counters
+        self.replays = 0
+        self.collapsed = 0
+    
+    @property
+    def store(self):
+        """Persistent tier, resolved on first use"""
+        if self._store is None:
+            from database import db
+            self._store = db
+        return self._store
+    
+    async def lookup(self, key: str) -> Optional[Dict]:
+        """Get the stored response for a key, if any"""
+        response = self._lookup_memory(key)
+        if response is not None:
+            return response
+        return await self._lookup_persistent(key)
+    
+    def _lookup_memory(self, key: str) -> Optional[Dict]:
+        """Get an unexpired response from the memory tier"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, stored_at = entry
+                if now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    return response
+                del self._entries[key]
+        return None
+    
+    async def _lookup_persistent(self, key: str) -> Optional[Dict]:
+        """Get a stored response from SQLite, promoting it to memory"""
+        now = time.time()
+        # SQLite work stays off the event loop
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(
+            None, self.store.get_idempotent_response, key, now - self.ttl
+        )
+        if row is None:
+            return None
+        
+        response, stored_at = row
+        with self._lock:
+            self._remember(key, response, stored_at)
+        return response
+    
+    async def run(self, key: Optional[str], compute: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Return the stored response for `key`, or compute and store it
+        
+        Concurrent calls with the same key share one computation. Failures
+        are not stored, so a retry after an error recomputes.
+        
+        Args:
+            key: Idempotency key (None disables deduplication)
+            compute: Coroutine function producing the response dict
+        
+        Returns:
+            Response dict
+        """
+        if key is None:
+            return await compute()
+        
+        # Everything up to registering the future runs without awaiting, so
+        # a same-key request can't slip in between the check and the claim
+        stored = self._lookup_memory(key)
+        if stored is not None:
+            self.replays += 1
+            return stored
+        
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.collapsed += 1
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self._lookup_persistent(key)
+            if response is not None:
+                self.replays += 1
+            else:
+                response = await compute()
+                await self.save(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+    
+    async def save(self, key: str, response: Dict):
+        """Store a response in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.store.save_idempotent_response, key, response, now)
+        if now - self._last_prune > _PRUNE_INTERVAL:
+            self._last_prune = now
+            await loop.run_in_executor(None, self.store.prune_idempotent_responses, now - self.ttl)
+    
+    def _remember(self, key: str, response: Dict, stored_at: float):
+        """Insert into the memory tier, evicting the oldest entries (lock held)"""
+        self._entries[key] = (response, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict:
+        """Counters and size of the store"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "inflight": len(self._inflight),
+                "replays": self.replays,
+                "collapsed": self.collapsed
+            }
+
+
+# Global instance
+idempotency_store = IdempotencyStore(
+    max_size=config.IDEMPOTENCY_CACHE_SIZE,
+    ttl=config.IDEMPOTENCY_TTL
+)
@@ -0,0 +1,197 @@
+"""
+Two-tier cache for Gemini intent classifications
+In-process LRU with TTL in front of a persistent SQLite table; the async
+variants read and write the SQLite tier in the default executor so the
+event loop never waits on the database lock
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import config
+from logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+
+# Leading @handles ("@MudrexHelp @someone any update?") don't change intent
+_LEADING_MENTIONS = re.compile(r'^(?:@\w+\s+)+')
+_WHITESPACE = re.compile(r'\s+')
+
+# How often expired rows are purged from the persistent tier
+_PRUNE_INTERVAL = 3600
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, collapse whitespace and drop leading mentions"""
+    text = _WHITESPACE.sub(' ', message.strip().lower())
+    return _LEADING_MENTIONS.sub('', text)
+
+
+class IntentCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, persistent: bool = True, store=None):
+        """
+        Initialize the intent cache
+        
+        Args:
+            max_size: Maximum entries kept in memory
+            ttl: Seconds an entry stays valid in either tier
+            persistent: Whether to use the SQLite tier
+            store: Object providing get_cached_intent/put_cached_intent
+                   (defaults to the global ConversationDB)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent = persistent
+        self._store = store
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune = time.time()
+        
+        # Counters
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @property
+    def store(self):
+        """Persistent tier, resolved on first use"""
+        if self._store is None:
+            from database import db
+            self._store = db
+        return self._store
+    
+    @staticmethod
+    def make_key(message: str, is_dm: bool) -> str:
+        """Build the cache key from normalized text and the DM flag"""
+        raw = f"{int(bool(is_dm))}:{normalize_message(message)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, message: str, is_dm: bool) -> Optional[str]:
+        """
+        Look up a cached intent
+        
+        Returns:
+            Intent string, or None on a miss
+        """
+        key = self.make_key(message, is_dm)
+        now = time.time()
+        intent = self._get_memory(key, now)
+        if intent is None:
+            intent = self._get_persistent(key, now)
+        return intent
+    
+    async def get_async(self, message: str, is_dm: bool) -> Optional[str]:
+        """get() with the SQLite tier read off the event loop"""
+        key = self.make_key(message, is_dm)
+        now = time.time()
+        intent = self._get_memory(key, now)
+        if intent is None and self.persistent:
+            loop = asyncio.get_running_loop()
+            intent = await loop.run_in_executor(None, self._get_persistent, key, now)
+        elif intent is None:
+            intent = self._get_persistent(key, now)
+        return intent
+    
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        """Look a key up in the LRU tier"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                intent, stored_at = entry
+                if now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return intent
+                del self._entries[key]
+                self.expirations += 1
+        return None
+    
+    def _get_persistent(self, key: str, now: float) -> Optional[str]:
+        """Look a key up in the SQLite tier, counting a miss if absent"""
+        if self.persistent:
+            try:
+                row = self.store.get_cached_intent(key, now - self.ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ Intent cache lookup failed: {e}", extra={"error": str(e)})
+                row = None
+            if row is not None:
+                intent, stored_at = row
+                with self._lock:
+                    self.persistent_hits += 1
+                    self._remember(key, intent, stored_at)
+                return intent
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, message: str, is_dm: bool, intent: str):
+        """Store an intent in both tiers"""
+        key = self.make_key(message, is_dm)
+        now = time.time()
+        with self._lock:
+            self._remember(key, intent, now)
+        self._put_persistent(key, intent, now)
+    
+    async def put_async(self, message: str, is_dm: bool, intent: str):
+        """put() with the SQLite tier written off the event loop"""
+        key = self.make_key(message, is_dm)
+        now = time.time()
+        with self._lock:
+            self._remember(key, intent, now)
+        if self.persistent:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._put_persistent, key, intent, now)
+    
+    def _put_persistent(self, key: str, intent: str, now: float):
+        """Store an intent in the SQLite tier, pruning expired rows hourly"""
+        if self.persistent:
+            try:
+                self.store.put_cached_intent(key, intent, now)
+                if now - self._last_prune > _PRUNE_INTERVAL:
+                    self._last_prune = now
+                    self.store.prune_intent_cache(now - self.ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ Intent cache write failed: {e}", extra={"error": str(e)})
+    
+    def _remember(self, key: str, intent: str, stored_at: float):
+        """Insert into the LRU tier, evicting the oldest entries (lock held)"""
+        self._entries[key] = (intent, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        """Drop the in-memory tier"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """Counters and size of the cache"""
+        with self._lock:
+            lookups = self.memory_hits + self.persistent_hits + self.misses
+            hits = self.memory_hits + self.persistent_hits
+            return {
+                "size": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+
+
+# Global instance (None when caching is disabled)
+intent_cache = IntentCache(
+    max_size=config.INTENT_CACHE_SIZE,
+    ttl=config.INTENT_CACHE_TTL,
+    persistent=config.INTENT_CACHE_PERSISTENT
+) if config.INTENT_CACHE_ENABLED else None
@@ -0,0 +1,175 @@
+"""
+Logging for the bot's long-running paths
+Records are handed to a background listener through a bounded queue, so a
+slow stdout/file never blocks message processing; output is plain text or
+one JSON object per line, with per-module levels and sampled debug records
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import config
+from metrics import log_records_dropped_total
+
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+_listener: Optional["DrainingQueueListener"] = None
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        """One JSON object per record, with `extra` fields at the top level"""
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    def __init__(self, rate: float):
+        """
+        Keep only a fraction of DEBUG records
+
+        Args:
+            rate: Share of DEBUG records kept (1 keeps all, 0 drops all)
+        """
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue, formatter: logging.Formatter):
+        """
+        QueueHandler that drops records instead of blocking when full
+
+        Args:
+            log_queue: Bounded queue drained by the listener thread
+            formatter: Used to render exception tracebacks before enqueueing
+        """
+        super().__init__(log_queue)
+        self.traceback_formatter = formatter
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Freeze the message and traceback; keep `extra` fields intact"""
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped_total.inc()
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full queue"""
+    
+    def enqueue_sentinel(self):
+        # put_nowait would raise on a full queue; the thread is still draining
+        self.queue.put(self._sentinel)
+    
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    """Parse "module=LEVEL,other=LEVEL" into a dict"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(force: bool = False) -> DrainingQueueListener:
+    """
+    Install the queue handler on the root logger (once per process)
+
+    Settings come from config: LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_FILE,
+    LOG_QUEUE_SIZE and LOG_DEBUG_SAMPLE_RATE.
+
+    Args:
+        force: Reconfigure even if logging was already set up
+
+    Returns:
+        The running QueueListener
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None and not force:
+            return _listener
+        if _listener is not None:
+            _listener.stop()
+
+        formatter = JsonFormatter() if config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+        if config.LOG_FILE:
+            output = logging.handlers.WatchedFileHandler(config.LOG_FILE, encoding="utf-8")
+        else:
+            output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue, formatter)
+        queue_handler.addFilter(DebugSampler(config.LOG_DEBUG_SAMPLE_RATE))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, NonBlockingQueueHandler):
+                root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(config.LOG_LEVEL)
+        for name, level in _parse_levels(config.LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = DrainingQueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Get a module logger, configuring logging on first use"""
+    configure_logging()
+    return logging.getLogger(name)
+
+
+atexit.register(shutdown_logging)
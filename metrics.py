@@ -0,0 +1,380 @@
+"""
+In-process metrics for the support bot
+Histograms, counters and gauges with a Prometheus text exposition (served
+by webhook_server at GET /metrics) and a plain snapshot for the monitor
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Latency buckets in seconds: sub-millisecond SQLite work up to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _label_key(labelnames: Sequence[str], labels: Dict[str, str]) -> Tuple[str, ...]:
+    """Label values in declaration order"""
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {list(labelnames)}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the exposition format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Render {name="value",...}"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value"""
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        """
+        Monotonically increasing count
+        
+        Args:
+            name: Metric name (Prometheus conventions, ending in _total)
+            help: One-line description
+            labelnames: Label names every increment must provide
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1, **labels):
+        """Add `amount` to the series selected by `labels`"""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels) -> float:
+        """Current value of one series"""
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+    
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {",".join(key) or "total": value for key, value in sorted(self._values.items())}
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, callback: Callable[[], Optional[Dict]] = None):
+        """
+        Point-in-time value, read from a callback at collection time
+        
+        Args:
+            name: Metric name
+            help: One-line description
+            callback: Returns {label value: number} for a gauge labelled
+                `labelname`, a single number, or None when unavailable
+        """
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labelname = None
+        self._value = 0.0
+    
+    def labelled(self, labelname: str) -> "Gauge":
+        """Treat callback results as {labelname value: number}"""
+        self.labelname = labelname
+        return self
+    
+    def set(self, value: float):
+        """Set the value of a gauge without a callback"""
+        self._value = value
+    
+    def _collect(self) -> Dict[Tuple[str, ...], float]:
+        if self.callback is None:
+            return {(): self._value}
+        try:
+            result = self.callback()
+        except Exception:
+            # A broken source must not take /metrics down with it
+            return {}
+        if result is None:
+            return {}
+        if isinstance(result, dict):
+            return {(str(label),): value for label, value in result.items()}
+        return {(): result}
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        labelnames = (self.labelname,) if self.labelname else ()
+        for key, value in sorted(self._collect().items()):
+            lines.append(f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return lines
+    
+    def snapshot(self) -> Dict[str, float]:
+        return {",".join(key) or "value": value for key, value in sorted(self._collect().items())}
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        """
+        Distribution of observed values in cumulative buckets
+        
+        Args:
+            name: Metric name (ending in _seconds for latencies)
+            help: One-line description
+            labelnames: Label names every observation must provide
+            buckets: Upper bounds, ascending (+Inf is added)
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label key -> [bucket counts (non-cumulative), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        """Record one observation"""
+        key = _label_key(self.labelnames, labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of a with-block (also when it raises)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """
+        Estimate a quantile by interpolating inside its bucket
+        
+        Returns:
+            Estimated value, or None if nothing was observed
+        """
+        with self._lock:
+            series = self._series.get(_label_key(self.labelnames, labels))
+            if series is None or series[2] == 0:
+                return None
+            counts, _, total = series[0][:], series[1], series[2]
+        return self._estimate(counts, total, q)
+    
+    def _estimate(self, counts: List[int], total: int, q: float) -> float:
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and seen + count >= rank:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            if bound != math.inf:
+                lower = bound
+        return lower
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total_sum, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total_sum)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+    
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """count, mean and estimated p50/p95/p99 (milliseconds) per series"""
+        with self._lock:
+            series = {key: (counts[:], total_sum, count) for key, (counts, total_sum, count) in self._series.items()}
+        
+        result = {}
+        for key, (counts, total_sum, count) in sorted(series.items()):
+            result[",".join(key) or "all"] = {
+                "count": count,
+                "mean_ms": total_sum / count * 1000,
+                "p50_ms": self._estimate(counts, count, 0.50) * 1000,
+                "p95_ms": self._estimate(counts, count, 0.95) * 1000,
+                "p99_ms": self._estimate(counts, count, 0.99) * 1000,
+            }
+        return result
+
+
+class Registry:
+    def __init__(self):
+        """Collection of metrics rendered together"""
+        self._metrics: List = []
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        """Add a metric and return it"""
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """Every metric's current values as plain dicts"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def format_snapshot(snapshot: Dict[str, Dict]) -> str:
+    """Human-readable summary of Registry.snapshot() for logs"""
+    lines = []
+    for name, values in snapshot.items():
+        if not values:
+            continue
+        for series, value in values.items():
+            if isinstance(value, dict):
+                lines.append(
+                    f"  {name}[{series}] n={value['count']} mean={value['mean_ms']:.1f}ms "
+                    f"p50={value['p50_ms']:.1f}ms p95={value['p95_ms']:.1f}ms p99={value['p99_ms']:.1f}ms"
+                )
+            else:
+                lines.append(f"  {name}[{series}] {_format_value(value)}")
+    return "\n".join(lines)
+
+
+# Gauge sources, imported lazily so metrics has no import-time dependencies
+
+def _intent_cache_stats() -> Optional[Dict]:
+    from intent_cache import intent_cache
+    if intent_cache is None:
+        return None
+    stats = intent_cache.stats()
+    return {
+        "size": stats["size"],
+        "memory_hits": stats["memory_hits"],
+        "persistent_hits": stats["persistent_hits"],
+        "misses": stats["misses"],
+        "evictions": stats["evictions"],
+    }
+
+
+def _user_cache_stats() -> Dict:
+    from database import db
+    return db.user_cache_stats()
+
+
+def _queue_depths() -> Dict:
+    from database import db
+    write_queue = db._write_queue
+    return {
+        "slack_outbox": db.count_pending_escalations(),
+        "pending_replies": db.count_pending_replies(),
+        "db_write_behind": write_queue.qsize() if write_queue is not None else 0,
+    }
+
+
+def _idempotency_stats() -> Dict:
+    from idempotency import idempotency_store
+    return idempotency_store.stats()
+
+
+# Global registry and the bot's metrics
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "bot_stage_duration_seconds",
+    "Time spent in each message processing stage",
+    labelnames=("stage",)
+))
+messages_total = registry.register(Counter(
+    "bot_messages_total",
+    "Messages processed, by intent and channel",
+    labelnames=("intent", "channel")
+))
+classification_fallbacks_total = registry.register(Counter(
+    "bot_classification_fallbacks_total",
+    "Classifications answered by the keyword fallback instead of Gemini",
+    labelnames=("reason",)
+))
+escalations_total = registry.register(Counter(
+    "bot_escalations_total",
+    "Escalations queued for Slack"
+))
+slack_deliveries_total = registry.register(Counter(
+    "bot_slack_deliveries_total",
+    "Slack outbox delivery attempts, by outcome",
+    labelnames=("outcome",)
+))
+replies_total = registry.register(Counter(
+    "bot_replies_total",
+    "Outbound reply send attempts, by kind and outcome",
+    labelnames=("kind", "outcome")
+))
+log_records_dropped_total = registry.register(Counter(
+    "bot_log_records_dropped_total",
+    "Log records dropped because the logging queue was full"
+))
+intent_cache_gauge = registry.register(Gauge(
+    "bot_intent_cache",
+    "Intent cache size and lookup counters",
+    _intent_cache_stats
+).labelled("stat"))
+user_cache_gauge = registry.register(Gauge(
+    "bot_user_state_cache",
+    "Per-user state cache size and lookup counters",
+    _user_cache_stats
+).labelled("stat"))
+queue_depth_gauge = registry.register(Gauge(
+    "bot_queue_depth",
+    "Items waiting in each background queue",
+    _queue_depths
+).labelled("queue"))
+idempotency_gauge = registry.register(Gauge(
+    "bot_idempotency_store",
+    "Webhook idempotency store size and counters",
+    _idempotency_stats
+).labelled("stat"))
@@ -0,0 +1,292 @@
+"""
+Outbound reply queue - sends the replies decided by the pipeline
+
+Replies are persisted in the pending_replies table before anything is sent,
+so a failed send is retried on its own without re-running classification,
+response generation or escalation. Sends are paced by token buckets sized
+to X's write limits; mentions and DMs are claimed and sent independently,
+and only as many rows are claimed as their bucket has tokens, so an empty
+bucket never holds up the other kind or sits on claimed rows.
+"""
+import asyncio
+import random
+import time
+from functools import partial
+from typing import Dict, Optional
+import config
+from database import get_db
+from logging_setup import get_logger
+from metrics import replies_total, stage_seconds
+
+logger = get_logger(__name__)
+
+
+# Extra seconds to wait past a rate limit reset
+RATE_LIMIT_MARGIN = 2
+
+# Client stream name recording rate limits for each kind of reply
+SEND_STREAMS = {
+    "mention": "replies",
+    "dm": "dm_sends",
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        """
+        Token bucket rate limiter
+        
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum burst size
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+    
+    @classmethod
+    def per_hour(cls, per_hour: float, burst: int) -> "TokenBucket":
+        """Bucket allowing `per_hour` sends per hour in bursts of `burst`"""
+        return cls(per_hour / 3600.0, burst)
+    
+    def _refill(self):
+        """Add the tokens earned since the last refill"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def available(self) -> int:
+        """Whole tokens that can be taken right now"""
+        self._refill()
+        return int(self.tokens)
+    
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is)"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+    
+    def take(self):
+        """Spend a token (callers check available() first)"""
+        self._refill()
+        self.tokens -= 1
+
+
+class ReplyQueue:
+    def __init__(self, client, batch_size: int = 10, account: str = ""):
+        """
+        Background task draining the pending_replies table
+        
+        Args:
+            client: Authenticated TwitterClient used for sending
+            batch_size: Replies claimed per round
+            account: Support account whose replies this queue sends
+        """
+        self.client = client
+        self.account = account
+        self.batch_size = batch_size
+        self.buckets = {
+            "mention": TokenBucket.per_hour(config.REPLY_TWEETS_PER_HOUR, config.REPLY_TWEET_BURST),
+            "dm": TokenBucket.per_hour(config.REPLY_DMS_PER_HOUR, config.REPLY_DM_BURST),
+        }
+        self.running = False
+        self._wake = asyncio.Event()
+    
+    async def enqueue(
+        self,
+        message_id: str,
+        kind: str,
+        target: str,
+        text: str,
+        username: str = None
+    ) -> bool:
+        """
+        Persist a reply (off the event loop) and wake the sender
+        
+        Args:
+            message_id: Tweet/DM being answered
+            kind: "mention" or "dm"
+            target: Tweet ID to reply to, or user ID to DM
+            text: Reply text
+            username: Recipient's username, for logging
+        
+        Returns:
+            bool: True if newly queued, False if a reply was already queued
+        """
+        queued = await self._run_db(
+            get_db().enqueue_reply,
+            message_id,
+            kind,
+            target,
+            text,
+            username=username,
+            account=self.account
+        )
+        self._wake.set()
+        return queued > 0
+    
+    async def _run_db(self, method, *args, **kwargs):
+        """
+        Run a ConversationDB call on the default executor
+        
+        Claims take the database write lock, which other processes sharing
+        the file can hold for up to the busy timeout; waiting for it must
+        not stall the monitor's event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(method, *args, **kwargs))
+    
+    def stop(self):
+        """Stop the sender after its current reply"""
+        self.running = False
+        self._wake.set()
+    
+    async def run(self):
+        """Send due replies, then sleep until the next one is due"""
+        self.running = True
+        while self.running:
+            try:
+                wait = await self._send_due()
+            except Exception as e:
+                logger.exception(f"❌ Reply queue error: {e}", extra={"account": self.account})
+                wait = config.REPLY_IDLE_POLL_INTERVAL
+            
+            if wait is None:
+                continue
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(),
+                    timeout=min(wait, config.REPLY_IDLE_POLL_INTERVAL)
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+    
+    async def _send_due(self) -> Optional[float]:
+        """
+        One round of sending, mentions and DMs side by side
+        
+        Returns:
+            Seconds to sleep, or None to go again immediately
+        """
+        waits = await asyncio.gather(*(self._send_due_kind(kind) for kind in self.buckets))
+        if None in waits:
+            return None
+        return min(waits)
+    
+    async def _send_due_kind(self, kind: str) -> Optional[float]:
+        """
+        Claim and send one kind's due replies, as many as its bucket allows
+        
+        Returns:
+            Seconds until this kind can send again, or None if it sent
+        """
+        db = get_db()
+        bucket = self.buckets[kind]
+        tokens = bucket.available()
+        if tokens < 1:
+            # Leave the rows unclaimed until the bucket refills
+            next_due = await self._run_db(db.next_reply_due, kind, self.account)
+            if next_due is None:
+                return config.REPLY_IDLE_POLL_INTERVAL
+            return max(next_due - time.time(), bucket.wait_time())
+        
+        lease = config.REPLY_SEND_LEASE
+        claimed_at = time.monotonic()
+        rows = await self._run_db(
+            db.claim_due_replies,
+            min(self.batch_size, tokens),
+            lease=lease,
+            kind=kind,
+            account=self.account
+        )
+        for row in rows:
+            # Hand unsent rows straight back when stopping, or well before
+            # the lease runs out and another sender could claim them
+            if not self.running or time.monotonic() - claimed_at > lease / 2:
+                await self._run_db(db.defer_reply, row["id"], time.time())
+                continue
+            await self._send(row)
+        if rows:
+            return None
+        
+        next_due = await self._run_db(db.next_reply_due, kind, self.account)
+        if next_due is None:
+            return config.REPLY_IDLE_POLL_INTERVAL
+        return max(0.0, next_due - time.time())
+    
+    async def _send(self, row: Dict):
+        """Send one reply and record the outcome"""
+        db = get_db()
+        stream = SEND_STREAMS[row["kind"]]
+        
+        # Don't spend an attempt while X is still throttling this kind of send
+        throttled = self.client.rate_limit_wait(stream)
+        if throttled > 0:
+            await self._run_db(db.defer_reply, row["id"], time.time() + throttled + RATE_LIMIT_MARGIN)
+            replies_total.inc(kind=row["kind"], outcome="deferred")
+            return
+        
+        self.buckets[row["kind"]].take()
+        with stage_seconds.time(stage="reply_send"):
+            if row["kind"] == "mention":
+                success = await self.client.reply_to_tweet(tweet_id=row["target"], text=row["text"])
+            else:
+                success = await self.client.send_dm(user_id=row["target"], text=row["text"])
+        
+        if success:
+            logger.info(f"✅ Replied to @{row['username']}", extra=self._log_fields(row))
+            await self._run_db(db.mark_reply_sent, row["id"], row["message_id"], row["kind"])
+            replies_total.inc(kind=row["kind"], outcome="sent")
+            return
+        
+        throttled = self.client.rate_limit_wait(stream)
+        if throttled > 0:
+            logger.warning(
+                f"⏳ Reply to @{row['username']} rate limited, retrying in {throttled:.0f}s",
+                extra=self._log_fields(row, retry_in=round(throttled))
+            )
+            await self._run_db(db.defer_reply, row["id"], time.time() + throttled + RATE_LIMIT_MARGIN)
+            replies_total.inc(kind=row["kind"], outcome="rate_limited")
+            return
+        
+        await self._record_failure(row, "send failed")
+    
+    def _log_fields(self, row: Dict, **fields) -> Dict:
+        """Structured log fields identifying a queued reply"""
+        return {
+            "account": self.account,
+            "reply_id": row["id"],
+            "message_id": row["message_id"],
+            "kind": row["kind"],
+            "username": row["username"],
+            **fields,
+        }
+    
+    async def _record_failure(self, row: Dict, error: str):
+        """Schedule a retry with exponential backoff, or give up"""
+        attempts = row["attempts"] + 1
+        if attempts >= config.REPLY_MAX_ATTEMPTS:
+            logger.error(
+                f"❌ Giving up on reply to @{row['username']} after {attempts} attempts",
+                extra=self._log_fields(row, attempts=attempts)
+            )
+            await self._run_db(get_db().mark_reply_failed, row["id"], row["message_id"], row["kind"], error)
+            replies_total.inc(kind=row["kind"], outcome="dead")
+            return
+        
+        backoff = config.REPLY_RETRY_BASE_DELAY * (2 ** (attempts - 1))
+        delay = min(backoff, config.REPLY_RETRY_MAX_DELAY) * random.uniform(0.8, 1.2)
+        logger.warning(
+            f"⚠️ Reply to @{row['username']} failed, retrying in {delay:.0f}s",
+            extra=self._log_fields(row, attempts=attempts, retry_in=round(delay))
+        )
+        await self._run_db(
+            get_db().mark_reply_failed,
+            row["id"],
+            row["message_id"],
+            row["kind"],
+            error,
+            next_attempt_at=time.time() + delay
+        )
+        replies_total.inc(kind=row["kind"], outcome="retry")
@@ -0,0 +1,346 @@
+"""
+Conversation retention - moves old history out of the live database
+
+Conversations older than RETENTION_DAYS are appended to per-month gzip
+JSONL files (conversations-YYYY-MM.jsonl.gz) in RETENTION_ARCHIVE_DIR, then
+deleted from SQLite in batches of RETENTION_BATCH_SIZE, each in its own
+short transaction so the bot's writers are never held up for long. Freed
+pages are handed back with incremental vacuum.
+
+Sent/dead replies, delivered/dead Slack escalations and settled ledger
+rows older than RETENTION_QUEUE_DAYS are not archived, just deleted in the
+same small batches.
+
+manifest.json lists every month's file with its row count and id/created_at
+range, plus the id through which the table has been archived. Only a
+contiguous run of ids is archived, so every row at or below that id is in
+the archive; a run interrupted between archiving and deleting a batch is
+finished by the next one (a batch archived twice is de-duplicated by id
+when reading).
+
+    python retention.py run                     # archive, prune, vacuum
+    python retention.py run --days 30 --dry-run
+    python retention.py convert                 # once, for older databases
+    python retention.py query --username alice --since 2024-01
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import takewhile
+from typing import Dict, Iterator, List
+import config
+from database import ConversationDB, get_db
+from logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+
+# Month key for rows without a created_at
+UNDATED = "undated"
+
+# PRAGMA auto_vacuum value for INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _month(row: Dict) -> str:
+    """Archive partition of a row (created_at is UTC "YYYY-MM-DD HH:MM:SS")"""
+    created_at = row.get("created_at")
+    return created_at[:7] if created_at else UNDATED
+
+
+class ConversationArchive:
+    def __init__(self, directory: str = None):
+        """
+        Per-month compressed archive of conversation rows
+        
+        Args:
+            directory: Where the month files and manifest.json live
+                (default: RETENTION_ARCHIVE_DIR)
+        """
+        self.directory = directory or config.RETENTION_ARCHIVE_DIR
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+        self.manifest = self._load_manifest()
+    
+    @property
+    def archived_through_id(self) -> int:
+        """Every conversation with an id up to this one is archived"""
+        return self.manifest["archived_through_id"]
+    
+    def _load_manifest(self) -> Dict:
+        if not os.path.exists(self.manifest_path):
+            return {"table": "conversations", "archived_through_id": 0, "months": {}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+    
+    def _save_manifest(self):
+        """Replace manifest.json atomically"""
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+    
+    def path_for(self, month: str) -> str:
+        """Archive file of one month"""
+        return os.path.join(self.directory, f"conversations-{month}.jsonl.gz")
+    
+    def append(self, rows: List[Dict]):
+        """
+        Archive rows (ascending ids) and advance archived_through_id
+        
+        Each call adds one gzip member per month file; gzip readers treat
+        the concatenated members as a single stream.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        by_month: Dict[str, List[Dict]] = {}
+        for row in rows:
+            by_month.setdefault(_month(row), []).append(row)
+        
+        for month, month_rows in by_month.items():
+            with open(self.path_for(month), "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as archive_file:
+                    for row in month_rows:
+                        archive_file.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                raw.flush()
+                os.fsync(raw.fileno())
+            
+            entry = self.manifest["months"].setdefault(month, {
+                "file": os.path.basename(self.path_for(month)),
+                "rows": 0,
+                "first_id": month_rows[0]["id"],
+                "first_created_at": month_rows[0]["created_at"],
+            })
+            entry["rows"] += len(month_rows)
+            entry["last_id"] = month_rows[-1]["id"]
+            entry["last_created_at"] = month_rows[-1]["created_at"]
+        
+        self.manifest["archived_through_id"] = rows[-1]["id"]
+        self.manifest["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._save_manifest()
+    
+    def iter_rows(
+        self,
+        username: str = None,
+        ticket_number: str = None,
+        since: str = None,
+        until: str = None
+    ) -> Iterator[Dict]:
+        """
+        Read archived conversations, oldest month first
+        
+        Args:
+            username: Only this user's conversations
+            ticket_number: Only conversations mentioning this ticket
+            since: First month to read ("YYYY-MM")
+            until: Last month to read ("YYYY-MM")
+        """
+        for month in sorted(self.manifest["months"]):
+            if (since or until) and month == UNDATED:
+                continue
+            if (since and month < since) or (until and month > until):
+                continue
+            
+            seen = set()
+            with gzip.open(self.path_for(month), "rt", encoding="utf-8") as archive_file:
+                for line in archive_file:
+                    row = json.loads(line)
+                    if row["id"] in seen:
+                        continue
+                    seen.add(row["id"])
+                    if username and row["username"] != username:
+                        continue
+                    if ticket_number and row["ticket_number"] != ticket_number:
+                        continue
+                    yield row
+
+
+def archive_conversations(
+    db: ConversationDB,
+    archive: ConversationArchive,
+    days: int = None,
+    batch_size: int = None,
+    pause: float = None,
+    dry_run: bool = False
+) -> int:
+    """
+    Move conversations older than `days` from the database to the archive
+    
+    Args:
+        db: Live conversation store
+        archive: Destination archive
+        days: Retention period (default: RETENTION_DAYS)
+        batch_size: Rows archived and deleted per transaction (default: RETENTION_BATCH_SIZE)
+        pause: Seconds between batches, giving writers the lock (default: RETENTION_BATCH_PAUSE)
+        dry_run: Only count what would be archived
+    
+    Returns:
+        Number of conversations archived (or that would be)
+    """
+    days = config.RETENTION_DAYS if days is None else days
+    batch_size = batch_size or config.RETENTION_BATCH_SIZE
+    pause = config.RETENTION_BATCH_PAUSE if pause is None else pause
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    
+    through_id = archive.archived_through_id
+    if not dry_run:
+        # Finish a batch a previous run archived but didn't get to delete
+        db.delete_conversations(0, through_id)
+    
+    archived = 0
+    while True:
+        rows = db.conversations_after(through_id, batch_size)
+        # Stop at the first recent row so the archived ids stay contiguous
+        expired = list(takewhile(lambda row: not row["created_at"] or row["created_at"] < cutoff, rows))
+        if not expired:
+            break
+        
+        if not dry_run:
+            archive.append(expired)
+            db.delete_conversations(through_id, expired[-1]["id"])
+        through_id = expired[-1]["id"]
+        archived += len(expired)
+        
+        if len(expired) < batch_size:
+            break
+        time.sleep(pause)
+    
+    logger.info(
+        f"🗃️  {'Would archive' if dry_run else 'Archived'} {archived} conversations older than {cutoff} UTC",
+        extra={"archived": archived, "cutoff": cutoff, "archived_through_id": through_id, "dry_run": dry_run}
+    )
+    return archived
+
+
+def prune_finished(
+    db: ConversationDB,
+    days: int = None,
+    batch_size: int = None,
+    pause: float = None
+) -> int:
+    """
+    Delete final-state queue, outbox and ledger rows older than `days`
+    
+    Args:
+        db: Live conversation store
+        days: Age after which finished rows go (default: RETENTION_QUEUE_DAYS)
+        batch_size: Rows deleted per transaction (default: RETENTION_BATCH_SIZE)
+        pause: Seconds between batches, giving writers the lock (default: RETENTION_BATCH_PAUSE)
+    
+    Returns:
+        Number of rows deleted
+    """
+    days = config.RETENTION_QUEUE_DAYS if days is None else days
+    batch_size = batch_size or config.RETENTION_BATCH_SIZE
+    pause = config.RETENTION_BATCH_PAUSE if pause is None else pause
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    
+    steps = [
+        ("replies", db.prune_finished_replies, cutoff.timestamp()),
+        ("escalations", db.prune_finished_escalations, cutoff.timestamp()),
+        ("ledger", db.prune_processed, cutoff.strftime("%Y-%m-%d %H:%M:%S")),
+    ]
+    pruned = {}
+    for name, prune, before in steps:
+        pruned[name] = 0
+        while True:
+            deleted = prune(before, batch_size)
+            pruned[name] += deleted
+            if deleted < batch_size:
+                break
+            time.sleep(pause)
+    
+    total = sum(pruned.values())
+    logger.info(
+        f"🧽 Pruned {total} finished rows older than {days} days",
+        extra={"pruned": pruned, "days": days}
+    )
+    return total
+
+
+def vacuum(db: ConversationDB, pages: int = None, pause: float = None) -> int:
+    """
+    Return the database's free pages to the filesystem in steps
+    
+    Args:
+        db: Live conversation store
+        pages: Pages freed per step (default: RETENTION_VACUUM_PAGES)
+        pause: Seconds between steps (default: RETENTION_BATCH_PAUSE)
+    
+    Returns:
+        Bytes the database file shrank by
+    """
+    if db.auto_vacuum_mode() != AUTO_VACUUM_INCREMENTAL:
+        logger.warning(
+            "⚠️ Database predates incremental vacuum; run `python retention.py convert` once "
+            "to reclaim space from archived rows"
+        )
+        return 0
+    
+    pages = pages or config.RETENTION_VACUUM_PAGES
+    pause = config.RETENTION_BATCH_PAUSE if pause is None else pause
+    
+    db.checkpoint()
+    size_before = os.path.getsize(db.db_path)
+    while db.incremental_vacuum(pages) > 0:
+        time.sleep(pause)
+    # In WAL mode the file only shrinks once the truncation is checkpointed
+    db.checkpoint()
+    reclaimed = size_before - os.path.getsize(db.db_path)
+    
+    logger.info(f"🧹 Vacuum reclaimed {reclaimed / 1024:.0f} KiB", extra={"reclaimed_bytes": reclaimed})
+    return reclaimed
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Archive, prune and query old conversations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    run = commands.add_parser("run", help="Archive expired conversations, prune old rows and vacuum")
+    run.add_argument("--days", type=int, default=config.RETENTION_DAYS, help="Keep this many days live")
+    run.add_argument("--queue-days", type=int, default=config.RETENTION_QUEUE_DAYS,
+                     help="Keep finished replies, escalations and ledger rows this many days")
+    run.add_argument("--dry-run", action="store_true", help="Only count what would be archived; delete nothing")
+    run.add_argument("--no-vacuum", action="store_true", help="Skip the incremental vacuum")
+    
+    commands.add_parser("convert", help="One-time VACUUM enabling incremental vacuum on an older database")
+    
+    query = commands.add_parser("query", help="Print archived conversations as JSON lines")
+    query.add_argument("--username", help="Only this user")
+    query.add_argument("--ticket", help="Only this ticket number")
+    query.add_argument("--since", help="First month (YYYY-MM)")
+    query.add_argument("--until", help="Last month (YYYY-MM)")
+    
+    args = parser.parse_args()
+    archive = ConversationArchive()
+    
+    if args.command == "query":
+        for row in archive.iter_rows(args.username, args.ticket, args.since, args.until):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return
+    
+    db = get_db()
+    if args.command == "convert":
+        if db.auto_vacuum_mode() == AUTO_VACUUM_INCREMENTAL:
+            print("✅ Incremental vacuum is already enabled")
+            return
+        print("🧹 Rewriting the database with incremental vacuum (blocks writers until done)...")
+        db.enable_incremental_vacuum()
+        print("✅ Incremental vacuum enabled")
+        return
+    
+    archived = archive_conversations(db, archive, days=args.days, dry_run=args.dry_run)
+    if args.dry_run:
+        return
+    pruned = prune_finished(db, days=args.queue_days)
+    if (archived or pruned) and not args.no_vacuum:
+        vacuum(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,123 +1,635 @@
 """
 Slack Integration for Ticket Escalations
 """
-import requests
 import json
+import random
+import threading
+import time
 from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 import config
+from database import get_db
+from logging_setup import get_logger
+from metrics import slack_deliveries_total, stage_seconds
 
+# requests is imported by get_session(), when the first Slack call is made
+if TYPE_CHECKING:
+    import requests
 
-def send_escalation(ticket_number: str, username: str, tweet_url: str = None, original_message: str = None):
+logger = get_logger(__name__)
+
+
+# Wait assumed for a 429 without a Retry-After header
+DEFAULT_RETRY_AFTER = 30.0
+
+# Shared HTTP session, created on first use by get_session()
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
+    """
+    Get the pooled HTTP session used for all Slack calls
+    
+    Keeps connections to the webhook host alive between posts instead of
+    doing a fresh TCP/TLS handshake every time.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=config.SLACK_POOL_SIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({'Content-Type': 'application/json'})
+                _session = session
+    return _session
+
+
+def _is_configured() -> bool:
+    """Whether a real Slack webhook URL is set"""
+    return bool(config.SLACK_WEBHOOK_URL) and config.SLACK_WEBHOOK_URL != "your_slack_webhook_url_here"
+
+
+def build_escalation_blocks(
+    ticket_number: str,
+    username: str,
+    tweet_url: str = None,
+    original_message: str = None,
+    escalated_at: float = None
+) -> List[Dict]:
     """
-    Send escalation notification to Slack
+    Build the Block Kit blocks for one escalation
     
     Args:
         ticket_number: The ticket number being escalated
         username: Twitter username
         tweet_url: URL to the original tweet
         original_message: The user's original complaint
+        escalated_at: Unix time of the escalation (defaults to now)
     
     Returns:
-        bool: Success status
+        List of Slack blocks
     """
-    if not config.SLACK_WEBHOOK_URL or config.SLACK_WEBHOOK_URL == "your_slack_webhook_url_here":
-        print(f"\n[MOCK SLACK] Would send escalation for ticket #{ticket_number}")
-        print(f"User: @{username}")
-        print(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    escalated = datetime.fromtimestamp(escalated_at) if escalated_at else datetime.now()
+    
+    blocks = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": "🚨 Twitter Ticket Escalation"
+            }
+        },
+        {
+            "type": "section",
+            "fields": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"*User:* @{username}"
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": f"*Ticket:* #{ticket_number}"
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": f"*Platform:* Twitter DM"
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": f"*Time:* {escalated.strftime('%Y-%m-%d %H:%M:%S')}"
+                }
+            ]
+        }
+    ]
+    
+    # Add original message if available
+    if original_message:
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Original Message:*\n{original_message}"
+            }
+        })
+    
+    # Add tweet link if available
+    if tweet_url:
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"<{tweet_url}|View Tweet>"
+            }
+        })
+    
+    # Add action button
+    blocks.append({
+        "type": "actions",
+        "elements": [
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "View Ticket"
+                },
+                "url": f"https://support.mudrex.com/ticket/{ticket_number}",
+                "style": "primary"
+            }
+        ]
+    })
+    
+    return blocks
+
+
+def build_digest_messages(escalations: List[Dict], max_blocks: int = 50) -> List[List[Dict]]:
+    """
+    Build coalesced digest messages for many escalations
+    
+    Escalations are grouped by (ticket, user), one section block per group,
+    and split across as many messages as needed to stay under max_blocks.
+    
+    Args:
+        escalations: Escalation dicts as stored in the outbox
+        max_blocks: Block limit per Slack message (Slack allows 50)
+    
+    Returns:
+        List of block lists, one per message
+    """
+    groups: Dict[Tuple[str, str], List[Dict]] = {}
+    for escalation in escalations:
+        key = (escalation["ticket_number"], escalation["username"])
+        groups.setdefault(key, []).append(escalation)
+    
+    sections = []
+    for (ticket_number, username), items in groups.items():
+        first = min(item.get("escalated_at") or time.time() for item in items)
+        lines = [
+            f"*Ticket:* #{ticket_number}   *User:* @{username}",
+            f"*First escalated:* {datetime.fromtimestamp(first).strftime('%H:%M:%S')}"
+            + (f"   *Escalations:* {len(items)}" if len(items) > 1 else "")
+        ]
+        original_message = next((item["original_message"] for item in items if item.get("original_message")), None)
         if original_message:
-            print(f"Message: {original_message}")
-        return True
+            lines.append(f"> {original_message[:200]}")
+        tweet_url = next((item["tweet_url"] for item in items if item.get("tweet_url")), None)
+        if tweet_url:
+            lines.append(f"<{tweet_url}|View Tweet>")
+        
+        sections.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "\n".join(lines)
+            },
+            "accessory": {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "View Ticket"
+                },
+                "url": f"https://support.mudrex.com/ticket/{ticket_number}"
+            }
+        })
     
-    try:
-        # Build Slack message blocks
-        blocks = [
+    # Header and summary take two blocks in every message
+    per_message = max(1, max_blocks - 2)
+    chunks = [sections[start:start + per_message] for start in range(0, len(sections), per_message)]
+    
+    messages = []
+    for number, chunk in enumerate(chunks, start=1):
+        part = f" ({number}/{len(chunks)})" if len(chunks) > 1 else ""
+        messages.append([
             {
                 "type": "header",
                 "text": {
                     "type": "plain_text",
-                    "text": "🚨 Twitter Ticket Escalation"
+                    "text": f"🚨 Twitter Escalation Digest{part}"
                 }
             },
             {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*User:* @{username}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*Ticket:* #{ticket_number}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*Platform:* Twitter DM"
-                    },
+                "type": "context",
+                "elements": [
                     {
                         "type": "mrkdwn",
-                        "text": f"*Time:* {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                        "text": f"{len(escalations)} escalations across {len(groups)} tickets"
                     }
                 ]
             }
-        ]
+        ] + chunk)
+    return messages
+
+
+def post_blocks(blocks: List[Dict]) -> Tuple[bool, Optional[str], Optional[float], bool]:
+    """
+    Post blocks to the Slack webhook
+    
+    Returns:
+        (success, error, retry_after seconds if rate limited else None,
+        permanent failure)
+    """
+    import requests
+    
+    payload = {
+        "channel": config.SLACK_CHANNEL,
+        "blocks": blocks
+    }
+    
+    try:
+        with stage_seconds.time(stage="slack_post"):
+            response = get_session().post(
+                config.SLACK_WEBHOOK_URL,
+                data=json.dumps(payload),
+                timeout=config.SLACK_TIMEOUT
+            )
+    except requests.RequestException as e:
+        return False, str(e), None, False
+    
+    if response.status_code == 200:
+        return True, None, None, False
+    
+    error = f"{response.status_code} - {response.text}"
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After")
+        return False, error, float(retry_after) if retry_after else DEFAULT_RETRY_AFTER, False
+    
+    # Other 4xx mean the payload or webhook is bad; retrying won't help
+    permanent = 400 <= response.status_code < 500
+    return False, error, None, permanent
+
+
+def send_escalation(ticket_number: str, username: str, tweet_url: str = None, original_message: str = None):
+    """
+    Send escalation notification to Slack immediately
+    
+    The bot's request path uses enqueue_escalation() instead; this direct
+    version is kept for scripts and manual testing.
+    
+    Args:
+        ticket_number: The ticket number being escalated
+        username: Twitter username
+        tweet_url: URL to the original tweet
+        original_message: The user's original complaint
+    
+    Returns:
+        bool: Success status
+    """
+    if not _is_configured():
+        _log_mock_escalation(ticket_number, username, original_message)
+        return True
+    
+    try:
+        blocks = build_escalation_blocks(ticket_number, username, tweet_url, original_message)
+        success, error, _, _ = post_blocks(blocks)
         
-        # Add original message if available
-        if original_message:
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Original Message:*\n{original_message}"
-                }
-            })
+        if success:
+            logger.info(f"✅ Escalation sent to Slack for ticket #{ticket_number}", extra={"ticket_number": ticket_number})
+            return True
+        else:
+            logger.error(f"❌ Failed to send to Slack: {error}", extra={"ticket_number": ticket_number, "error": error})
+            return False
+            
+    except Exception as e:
+        logger.exception(f"❌ Error sending Slack notification: {e}", extra={"ticket_number": ticket_number})
+        return False
+
+
+def _log_mock_escalation(ticket_number: str, username: str, original_message: str = None, escalated_at: float = None):
+    """Log what would be sent when no Slack webhook is configured"""
+    escalated = datetime.fromtimestamp(escalated_at) if escalated_at else datetime.now()
+    logger.info(
+        f"[MOCK SLACK] Would send escalation for ticket #{ticket_number} from @{username} "
+        f"at {escalated.strftime('%Y-%m-%d %H:%M:%S')}",
+        extra={
+            "ticket_number": ticket_number,
+            "username": username,
+            "escalated_at": escalated.isoformat(),
+            "original_message": original_message,
+        }
+    )
+
+
+def enqueue_escalation(ticket_number: str, username: str, tweet_url: str = None, original_message: str = None) -> int:
+    """
+    Queue an escalation for background delivery to Slack
+    
+    The escalation is written to the durable outbox and handed to the
+    dispatcher thread, so the caller never waits on Slack.
+    
+    Args:
+        ticket_number: The ticket number being escalated
+        username: Twitter username
+        tweet_url: URL to the original tweet
+        original_message: The user's original complaint
+    
+    Returns:
+        Outbox row ID
+    """
+    outbox_id = get_db().enqueue_escalation({
+        "ticket_number": ticket_number,
+        "username": username,
+        "tweet_url": tweet_url,
+        "original_message": original_message,
+        "escalated_at": time.time()
+    })
+    dispatcher.start()
+    dispatcher.wake()
+    return outbox_id
+
+
+class EscalationDispatcher:
+    def __init__(self, batch_size: int = 20):
+        """
+        Background worker delivering the Slack outbox
         
-        # Add tweet link if available
-        if tweet_url:
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"<{tweet_url}|View Tweet>"
-                }
-            })
+        Args:
+            batch_size: Outbox rows claimed per round
+        """
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # When a post (or mock post) was last attempted, successful or not;
+        # drives the quiet-period bypass
+        self._last_sent_at = 0.0
+        # Slack answered 429: no posts from this dispatcher until then
+        self._blocked_until = 0.0
+    
+    def start(self):
+        """Start the worker thread (no-op if it is already running)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="slack-dispatcher",
+                daemon=True
+            )
+            self._thread.start()
+    
+    def stop(self, timeout: float = 10):
+        """Stop the worker after its current delivery"""
+        self._stopping.set()
+        self._wake.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+    
+    def wake(self):
+        """Tell the worker new escalations are waiting"""
+        self._wake.set()
+    
+    def _run(self):
+        """Deliver due escalations, then sleep until the next one is due"""
+        while not self._stopping.is_set():
+            try:
+                blocked = self._blocked_until - time.time()
+                if blocked > 0:
+                    wait = blocked
+                elif config.SLACK_COALESCE_WINDOW > 0:
+                    wait = self._run_coalesced()
+                else:
+                    wait = self._run_individual()
+            except Exception as e:
+                logger.exception(f"❌ Slack dispatcher error: {e}")
+                wait = config.SLACK_IDLE_POLL_INTERVAL
+            
+            if wait is None:
+                continue
+            self._wake.wait(min(wait, config.SLACK_IDLE_POLL_INTERVAL))
+            self._wake.clear()
+    
+    def _seconds_until_next_due(self) -> float:
+        """How long to sleep before the next outbox row is due"""
+        next_due = get_db().next_escalation_due()
+        if next_due is None:
+            return config.SLACK_IDLE_POLL_INTERVAL
+        return max(0.0, next_due - time.time())
+    
+    def _run_individual(self) -> Optional[float]:
+        """
+        One round of one-message-per-escalation delivery
         
-        # Add action button
-        blocks.append({
-            "type": "actions",
-            "elements": [
-                {
-                    "type": "button",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "View Ticket"
-                    },
-                    "url": f"https://support.mudrex.com/ticket/{ticket_number}",
-                    "style": "primary"
-                }
-            ]
-        })
+        Returns:
+            Seconds to sleep, or None to go again immediately
+        """
+        claimed_at = time.monotonic()
+        rows = get_db().claim_due_escalations(self.batch_size, lease=config.SLACK_DELIVERY_LEASE)
+        for index, row in enumerate(rows):
+            if self._should_release(claimed_at):
+                self._release(rows[index:])
+                break
+            self._deliver(row)
+        if rows:
+            return None
+        return self._seconds_until_next_due()
+    
+    def _should_release(self, claimed_at: float) -> bool:
+        """
+        Whether the rest of a claimed round must be handed back unsent
         
-        payload = {
-            "channel": config.SLACK_CHANNEL,
-            "blocks": blocks
-        }
+        True when stopping, when Slack is rate limiting us, or once half
+        the lease has gone (after that another process's dispatcher could
+        claim the same rows and post them a second time).
+        """
+        return (
+            self._stopping.is_set()
+            or time.time() < self._blocked_until
+            or time.monotonic() - claimed_at > config.SLACK_DELIVERY_LEASE / 2
+        )
+    
+    def _release(self, rows: List[Dict]):
+        """Hand claimed rows back without counting an attempt"""
+        get_db().defer_escalations(
+            [row["id"] for row in rows],
+            max(time.time(), self._blocked_until)
+        )
+    
+    def _run_coalesced(self) -> Optional[float]:
+        """
+        One round of coalesced delivery
         
-        response = requests.post(
-            config.SLACK_WEBHOOK_URL,
-            data=json.dumps(payload),
-            headers={'Content-Type': 'application/json'}
+        The first escalation after a quiet period goes out on its own right
+        away; anything after that waits until SLACK_COALESCE_WINDOW has
+        passed since the oldest waiting row and is sent as a digest.
+        
+        Returns:
+            Seconds to sleep, or None to go again immediately
+        """
+        db = get_db()
+        oldest_due = db.next_escalation_due()
+        if oldest_due is None:
+            return config.SLACK_IDLE_POLL_INTERVAL
+        
+        now = time.time()
+        if oldest_due > now:
+            return oldest_due - now
+        
+        if now - self._last_sent_at >= config.SLACK_QUIET_PERIOD:
+            rows = db.claim_due_escalations(1, lease=config.SLACK_DELIVERY_LEASE)
+            for row in rows:
+                self._deliver(row)
+            return None
+        
+        flush_at = oldest_due + config.SLACK_COALESCE_WINDOW
+        if now < flush_at:
+            return flush_at - now
+        
+        claimed_at = time.monotonic()
+        rows = db.claim_due_escalations(
+            config.SLACK_DIGEST_MAX_ESCALATIONS,
+            lease=config.SLACK_DELIVERY_LEASE
         )
+        if len(rows) == 1:
+            self._deliver(rows[0])
+        elif rows:
+            self._deliver_digest(rows, claimed_at)
+        return None
+    
+    def _deliver(self, row: Dict):
+        """Deliver one outbox row and record the outcome"""
+        escalation = row["escalation"]
+        ticket_number = escalation["ticket_number"]
         
-        if response.status_code == 200:
-            print(f"✅ Escalation sent to Slack for ticket #{ticket_number}")
-            return True
-        else:
-            print(f"❌ Failed to send to Slack: {response.status_code} - {response.text}")
-            return False
+        self._last_sent_at = time.time()
+        if not _is_configured():
+            _log_mock_escalation(
+                ticket_number,
+                escalation["username"],
+                escalation.get("original_message"),
+                escalation.get("escalated_at")
+            )
+            get_db().mark_escalations_delivered([row["id"]])
+            slack_deliveries_total.inc(outcome="mock")
+            return
+        
+        blocks = build_escalation_blocks(
+            ticket_number,
+            escalation["username"],
+            escalation.get("tweet_url"),
+            escalation.get("original_message"),
+            escalation.get("escalated_at")
+        )
+        success, error, retry_after, permanent = post_blocks(blocks)
+        
+        if success:
+            logger.info(f"✅ Escalation sent to Slack for ticket #{ticket_number}", extra={"ticket_number": ticket_number})
+            get_db().mark_escalations_delivered([row["id"]])
+            slack_deliveries_total.inc(outcome="delivered")
+            return
+        
+        if retry_after is not None:
+            self._rate_limited([row], error, retry_after)
+            return
+        self._record_failure([row["id"]], row["attempts"] + 1, error, permanent)
+    
+    def _deliver_digest(self, rows: List[Dict], claimed_at: float):
+        """Deliver many outbox rows as one or more digest messages"""
+        self._last_sent_at = time.time()
+        if not _is_configured():
+            tickets = [f"#{row['escalation']['ticket_number']}" for row in rows]
+            logger.info(
+                f"[MOCK SLACK] Would send a digest of {len(rows)} escalations: {', '.join(tickets)}",
+                extra={"escalations": len(rows), "tickets": tickets}
+            )
+            get_db().mark_escalations_delivered([row["id"] for row in rows])
+            slack_deliveries_total.inc(len(rows), outcome="mock")
+            return
+        
+        # Build each message from its own rows so outcomes map back to rows
+        rows_by_key: Dict[Tuple[str, str], List[Dict]] = {}
+        for row in rows:
+            escalation = row["escalation"]
+            key = (escalation["ticket_number"], escalation["username"])
+            rows_by_key.setdefault(key, []).append(row)
+        
+        per_message = max(1, config.SLACK_MAX_BLOCKS_PER_MESSAGE - 2)
+        groups = list(rows_by_key.values())
+        messages = [
+            [row for group in groups[start:start + per_message] for row in group]
+            for start in range(0, len(groups), per_message)
+        ]
+        for index, message_rows in enumerate(messages):
+            if self._should_release(claimed_at):
+                self._release([row for unsent in messages[index:] for row in unsent])
+                break
+            blocks = build_digest_messages(
+                [row["escalation"] for row in message_rows],
+                max_blocks=config.SLACK_MAX_BLOCKS_PER_MESSAGE
+            )[0]
+            self._last_sent_at = time.time()
+            success, error, retry_after, permanent = post_blocks(blocks)
             
-    except Exception as e:
-        print(f"❌ Error sending Slack notification: {e}")
-        return False
+            outbox_ids = [row["id"] for row in message_rows]
+            if success:
+                logger.info(
+                    f"✅ Escalation digest sent to Slack ({len(message_rows)} escalations)",
+                    extra={"escalations": len(message_rows)}
+                )
+                get_db().mark_escalations_delivered(outbox_ids)
+                slack_deliveries_total.inc(len(outbox_ids), outcome="delivered")
+            elif retry_after is not None:
+                self._rate_limited(message_rows, error, retry_after)
+            else:
+                attempts = max(row["attempts"] for row in message_rows) + 1
+                self._record_failure(outbox_ids, attempts, error, permanent)
+    
+    def _rate_limited(self, rows: List[Dict], error: str, retry_after: float):
+        """
+        Pause the whole dispatcher until Slack's Retry-After has passed
+        
+        The rows go back to the outbox without counting an attempt, so a
+        long 429 spell can never exhaust SLACK_MAX_ATTEMPTS; the rest of
+        the round is handed back by _should_release.
+        """
+        self._blocked_until = time.time() + retry_after
+        logger.warning(
+            f"⏳ Slack rate limited ({error}), pausing deliveries for {retry_after:.1f}s",
+            extra={"outbox_ids": [row["id"] for row in rows], "error": error, "retry_in": retry_after}
+        )
+        self._release(rows)
+        slack_deliveries_total.inc(len(rows), outcome="rate_limited")
+    
+    def _record_failure(
+        self,
+        outbox_ids: List[int],
+        attempts: int,
+        error: str,
+        permanent: bool = False
+    ):
+        """Schedule a retry with exponential backoff, or give up"""
+        if permanent or attempts >= config.SLACK_MAX_ATTEMPTS:
+            logger.error(
+                f"❌ Giving up on Slack escalation after {attempts} attempts: {error}",
+                extra={"outbox_ids": outbox_ids, "attempts": attempts, "error": error}
+            )
+            get_db().mark_escalations_failed(outbox_ids, error)
+            slack_deliveries_total.inc(len(outbox_ids), outcome="dead")
+            return
+        
+        backoff = config.SLACK_RETRY_BASE_DELAY * (2 ** (attempts - 1))
+        retry_after = min(backoff, config.SLACK_RETRY_MAX_DELAY) * random.uniform(0.8, 1.2)
+        logger.warning(
+            f"⚠️ Slack delivery failed ({error}), retrying in {retry_after:.1f}s",
+            extra={"outbox_ids": outbox_ids, "attempts": attempts, "error": error, "retry_in": retry_after}
+        )
+        get_db().mark_escalations_failed(outbox_ids, error, next_attempt_at=time.time() + retry_after)
+        slack_deliveries_total.inc(len(outbox_ids), outcome="retry")
+
+
+# Global instance
+dispatcher = EscalationDispatcher()
 
 
 def send_test_message():
@@ -139,10 +651,10 @@ def send_test_message():
     }
     
     try:
-        response = requests.post(
+        response = get_session().post(
             config.SLACK_WEBHOOK_URL,
             data=json.dumps(payload),
-            headers={'Content-Type': 'application/json'}
+            timeout=config.SLACK_TIMEOUT
         )
         return response.status_code == 200
     except Exception as e:
@@ -0,0 +1,226 @@
+"""
+Supervisor - runs one monitor worker process per support account
+
+Accounts are listed in a JSON file (TWITTER_ACCOUNTS_FILE):
+
+    [
+        {"name": "support", "username": "...", "email": "...", "password": "..."},
+        {"name": "help", "username": "...", "email": "..."}
+    ]
+
+A missing password is read from TWITTER_PASSWORD_<NAME>, and each account
+gets its own cookies file unless "cookies_file" is set. An account without
+a username, email or password is rejected rather than falling back to the
+single-account TWITTER_* settings, which would log in as another account.
+
+All workers share the SQLite conversation store (WAL mode with a busy
+timeout); stream cursors and queued replies are namespaced by account name.
+"""
+import json
+import multiprocessing
+import os
+import signal
+import time
+from typing import Dict, List
+from logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+
+def load_accounts(path: str) -> List[Dict]:
+    """
+    Load and validate the account list
+    
+    Args:
+        path: Path to the accounts JSON file
+    
+    Returns:
+        List of account dicts with name, username, email, password and
+        cookies_file filled in
+    
+    Raises:
+        ValueError: On a missing or duplicate name, or missing credentials
+    """
+    with open(path) as f:
+        accounts = json.load(f)
+    
+    names = set()
+    for account in accounts:
+        name = account.get("name")
+        if not name:
+            raise ValueError(f"Account without a name in {path}")
+        if name in names:
+            raise ValueError(f"Duplicate account name '{name}' in {path}")
+        names.add(name)
+        
+        if not account.get("password"):
+            account["password"] = os.getenv(f"TWITTER_PASSWORD_{name.upper()}")
+        missing = [field for field in ("username", "email", "password") if not account.get(field)]
+        if missing:
+            raise ValueError(
+                f"Account '{name}' in {path} is missing {', '.join(missing)} "
+                f"(the password may also come from TWITTER_PASSWORD_{name.upper()})"
+            )
+        account.setdefault("cookies_file", f"./data/twitter_cookies_{name}.json")
+    
+    return accounts
+
+
+def run_worker(account: Dict):
+    """
+    Worker process entry point: monitor a single account
+    
+    Imports happen here so that every spawned process opens its own
+    database connection and Twikit client. The monitor handles the
+    supervisor's SIGTERM on its event loop and shuts down gracefully.
+    """
+    from twitter_client import TwitterClient
+    from twitter_monitor import TwitterMonitor, monitor_settings_from_env
+    
+    client = TwitterClient(
+        username=account.get("username"),
+        email=account.get("email"),
+        password=account.get("password"),
+        cookies_file=account.get("cookies_file")
+    )
+    monitor = TwitterMonitor(
+        client=client,
+        account=account["name"],
+        **monitor_settings_from_env()
+    )
+    try:
+        monitor.start()
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor:
+    def __init__(
+        self,
+        accounts: List[Dict],
+        restart_base_delay: float = 5,
+        restart_max_delay: float = 300
+    ):
+        """
+        Start, watch and restart one worker process per account
+        
+        Args:
+            accounts: Accounts from load_accounts()
+            restart_base_delay: Delay before the first restart of a crashed worker
+            restart_max_delay: Cap for the exponential restart backoff
+        """
+        self.accounts = {account["name"]: account for account in accounts}
+        self.restart_base_delay = restart_base_delay
+        self.restart_max_delay = restart_max_delay
+        self.running = False
+        
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._started_at: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {name: 0 for name in self.accounts}
+        self._restart_at: Dict[str, float] = {}
+    
+    def _start(self, name: str):
+        """Launch the worker for one account"""
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.accounts[name],),
+            name=f"monitor-{name}",
+            daemon=False
+        )
+        process.start()
+        self._processes[name] = process
+        self._started_at[name] = time.monotonic()
+        logger.info(
+            f"🚀 Started worker for '{name}' (pid {process.pid})",
+            extra={"account": name, "pid": process.pid}
+        )
+    
+    def _check(self, name: str):
+        """Schedule or perform a restart if the account's worker has exited"""
+        now = time.monotonic()
+        process = self._processes.get(name)
+        
+        if process is not None and process.is_alive():
+            return
+        
+        if process is not None:
+            # A worker that stayed up for a while resets the backoff
+            if now - self._started_at[name] >= self.restart_max_delay:
+                self._failures[name] = 0
+            self._failures[name] += 1
+            delay = min(
+                self.restart_base_delay * (2 ** (self._failures[name] - 1)),
+                self.restart_max_delay
+            )
+            logger.warning(
+                f"⚠️ Worker for '{name}' exited with code {process.exitcode}, restarting in {delay:.0f}s",
+                extra={"account": name, "exit_code": process.exitcode, "restart_in": delay}
+            )
+            self._processes[name] = None
+            self._restart_at[name] = now + delay
+            return
+        
+        if now >= self._restart_at.get(name, 0):
+            self._start(name)
+    
+    def stop(self, signum=None, frame=None):
+        """Ask the supervise loop to shut down"""
+        self.running = False
+    
+    def _shutdown(self, timeout: float = 30):
+        """Terminate every worker, killing any that do not exit in time"""
+        logger.info("⚠️  Stopping workers...")
+        processes = [p for p in self._processes.values() if p is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.error(f"❌ Worker {process.name} did not stop, killing it", extra={"pid": process.pid})
+                process.kill()
+                process.join()
+    
+    def run(self, check_interval: float = 1.0):
+        """Run until SIGINT/SIGTERM"""
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        
+        logger.info(f"👥 Supervising {len(self.accounts)} account(s): {', '.join(self.accounts)}")
+        self.running = True
+        for name in self.accounts:
+            self._start(name)
+        
+        try:
+            while self.running:
+                time.sleep(check_interval)
+                for name in self.accounts:
+                    if self.running:
+                        self._check(name)
+        finally:
+            self._shutdown()
+
+
+def main():
+    """Main entry point"""
+    accounts_file = os.getenv("TWITTER_ACCOUNTS_FILE", "./accounts.json")
+    restart_base_delay = float(os.getenv("SUPERVISOR_RESTART_BASE_DELAY", "5"))
+    restart_max_delay = float(os.getenv("SUPERVISOR_RESTART_MAX_DELAY", "300"))
+    
+    accounts = load_accounts(accounts_file)
+    if not accounts:
+        logger.error(f"❌ No accounts configured in {accounts_file}")
+        return
+    
+    Supervisor(
+        accounts,
+        restart_base_delay=restart_base_delay,
+        restart_max_delay=restart_max_delay
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
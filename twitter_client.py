@@ -5,27 +5,53 @@ Handles authentication, monitoring mentions, DMs, and posting responses
 import asyncio
 import os
 import json
-from typing import List, Dict, Optional
+import time
+from typing import AsyncIterator, List, Dict, Optional
 from datetime import datetime
 from twikit import Client
 from twikit.errors import TwitterException, TooManyRequests
 import config
+from logging_setup import get_logger
+
+logger = get_logger(__name__)
 
 
 class TwitterClient:
-    def __init__(self):
+    def __init__(
+        self,
+        username: str = None,
+        email: str = None,
+        password: str = None,
+        cookies_file: str = None
+    ):
+        """
+        Initialize a Twitter client for one account
+        
+        Args:
+            username: Login username (default: TWITTER_USERNAME)
+            email: Login email (default: TWITTER_EMAIL)
+            password: Login password (default: TWITTER_PASSWORD)
+            cookies_file: Saved session path (default: TWITTER_COOKIES_FILE)
+        """
         self.client = Client('en-US')
         self.authenticated = False
         self.user_id = None
         self.username = None
         
-        # Credentials from env
-        self.twitter_username = os.getenv("TWITTER_USERNAME")
-        self.twitter_email = os.getenv("TWITTER_EMAIL")
-        self.twitter_password = os.getenv("TWITTER_PASSWORD")
+        # Credentials, falling back to env
+        self.twitter_username = username or os.getenv("TWITTER_USERNAME")
+        self.twitter_email = email or os.getenv("TWITTER_EMAIL")
+        self.twitter_password = password or os.getenv("TWITTER_PASSWORD")
         
         # Cookies file path
-        self.cookies_file = os.getenv("TWITTER_COOKIES_FILE", "./data/twitter_cookies.json")
+        self.cookies_file = cookies_file or os.getenv("TWITTER_COOKIES_FILE", "./data/twitter_cookies.json")
+        
+        # DM polling: conversations fetched in parallel, each with a timeout
+        self.dm_fetch_concurrency = int(os.getenv("TWITTER_DM_FETCH_CONCURRENCY", "5"))
+        self.dm_fetch_timeout = float(os.getenv("TWITTER_DM_FETCH_TIMEOUT", "10"))
+        
+        # Unix time at which each throttled stream's rate limit resets
+        self.rate_limit_resets: Dict[str, float] = {}
     
     async def authenticate(self) -> bool:
         """
@@ -37,7 +63,7 @@ class TwitterClient:
         try:
             # Try loading saved cookies first
             if os.path.exists(self.cookies_file):
-                print("🔑 Loading saved session...")
+                logger.info("🔑 Loading saved session...")
                 self.client.load_cookies(self.cookies_file)
                 
                 # Verify session is still valid
@@ -46,17 +72,17 @@ class TwitterClient:
                     self.user_id = user.id
                     self.username = user.screen_name
                     self.authenticated = True
-                    print(f"✅ Authenticated as @{self.username}")
+                    logger.info(f"✅ Authenticated as @{self.username}", extra={"account": self.username})
                     return True
                 except:
-                    print("⚠️ Saved session expired, re-authenticating...")
+                    logger.warning("⚠️ Saved session expired, re-authenticating...")
             
             # Fresh login
             if not all([self.twitter_username, self.twitter_email, self.twitter_password]):
-                print("❌ Twitter credentials not found in .env")
+                logger.error("❌ Twitter credentials not found in .env")
                 return False
             
-            print("🔑 Logging in to Twitter...")
+            logger.info("🔑 Logging in to Twitter...")
             await self.client.login(
                 auth_info_1=self.twitter_username,
                 auth_info_2=self.twitter_email,
@@ -64,7 +90,7 @@ class TwitterClient:
             )
             
             # Save cookies
-            os.makedirs(os.path.dirname(self.cookies_file), exist_ok=True)
+            os.makedirs(os.path.dirname(self.cookies_file) or ".", exist_ok=True)
             self.client.save_cookies(self.cookies_file)
             
             # Get user info
@@ -73,14 +99,14 @@ class TwitterClient:
             self.username = user.screen_name
             self.authenticated = True
             
-            print(f"✅ Successfully authenticated as @{self.username}")
+            logger.info(f"✅ Successfully authenticated as @{self.username}", extra={"account": self.username})
             return True
             
         except TwitterException as e:
-            print(f"❌ Twitter authentication failed: {e}")
+            logger.error(f"❌ Twitter authentication failed: {e}")
             return False
         except Exception as e:
-            print(f"❌ Unexpected error during authentication: {e}")
+            logger.error(f"❌ Unexpected error during authentication: {e}")
             return False
     
     async def get_mentions(self, count: int = 20) -> List[Dict]:
@@ -93,45 +119,112 @@ class TwitterClient:
         Returns:
             List of mention dictionaries
         """
-        if not self.authenticated:
-            print("❌ Not authenticated. Call authenticate() first.")
+        mentions = []
+        try:
+            async for page in self.iter_mentions(page_size=count, max_pages=1):
+                mentions.extend(page)
+        except TwitterException as e:
+            logger.error(f"❌ Error fetching mentions: {e}")
             return []
         
+        logger.debug(f"📬 Retrieved {len(mentions)} mentions", extra={"count": len(mentions)})
+        return mentions
+    
+    async def iter_mentions(
+        self,
+        since_id: str = None,
+        max_id: str = None,
+        page_size: int = 20,
+        max_pages: int = 10
+    ) -> AsyncIterator[List[Dict]]:
+        """
+        Stream mentions newer than since_id, one page at a time
+        
+        Follows the search cursor from the newest mention backwards until it
+        reaches since_id, runs out of results or has fetched max_pages
+        pages. Only the current page is held in memory.
+        
+        Args:
+            since_id: Newest mention already handled; None fetches one page
+            max_id: Only return mentions up to this ID (resumes a catch-up
+                that ran out of pages)
+            page_size: Mentions requested per page
+            max_pages: Page budget for one catch-up
+            
+        Yields:
+            One list of mention dictionaries per page, newest first (may be
+            empty if a page only held our own tweets)
+        
+        Raises:
+            TwitterException: If a page cannot be fetched (TooManyRequests
+                is recorded for rate_limit_wait("mentions") first)
+        """
+        if not self.authenticated:
+            logger.error("❌ Not authenticated. Call authenticate() first.")
+            return
+        
+        if since_id is None:
+            max_pages = 1
+        since = int(since_id) if since_id is not None else None
+        
+        # Let search do the range filtering; the id checks below still guard
+        # against results outside it
+        query = f"@{self.username}"
+        if since_id is not None:
+            query += f" since_id:{since_id}"
+        if max_id is not None:
+            query += f" max_id:{max_id}"
+        
         try:
-            # Search for mentions
             tweets = await self.client.search_tweet(
-                f"@{self.username}",
+                query,
                 product='Latest',
-                count=count
+                count=page_size
             )
             
-            mentions = []
-            for tweet in tweets:
-                # Skip our own tweets
-                if tweet.user.screen_name == self.username:
-                    continue
+            for page_number in range(1, max_pages + 1):
+                mentions = []
+                reached_since = False
+                for tweet in tweets:
+                    if since is not None and int(tweet.id) <= since:
+                        reached_since = True
+                        break
+                    if max_id is not None and int(tweet.id) > int(max_id):
+                        continue
+                    # Skip our own tweets
+                    if tweet.user.screen_name == self.username:
+                        continue
+                    mentions.append(self._mention_from_tweet(tweet))
                 
-                mention = {
-                    'id': tweet.id,
-                    'username': tweet.user.screen_name,
-                    'user_id': tweet.user.id,
-                    'text': tweet.text,
-                    'created_at': tweet.created_at,
-                    'tweet_url': f"https://twitter.com/{tweet.user.screen_name}/status/{tweet.id}",
-                    'is_reply': tweet.in_reply_to is not None,
-                    'in_reply_to_id': tweet.in_reply_to
-                }
-                mentions.append(mention)
-            
-            print(f"📬 Retrieved {len(mentions)} mentions")
-            return mentions
+                if len(tweets) == 0:
+                    return
+                yield mentions
+                if reached_since:
+                    return
+                if page_number == max_pages:
+                    if since is not None:
+                        logger.warning(f"⚠️ Mention page budget ({max_pages}) used before reaching {since_id}")
+                    return
+                
+                tweets = await tweets.next()
             
         except TooManyRequests as e:
-            print(f"⚠️ Rate limit hit. Reset at: {e.rate_limit_reset}")
-            return []
-        except TwitterException as e:
-            print(f"❌ Error fetching mentions: {e}")
-            return []
+            logger.warning(f"⚠️ Rate limit hit. Reset at: {e.rate_limit_reset}", extra={"rate_limit_reset": e.rate_limit_reset})
+            self._record_rate_limit("mentions", e)
+            raise
+    
+    def _mention_from_tweet(self, tweet) -> Dict:
+        """Convert a twikit Tweet into a mention dictionary"""
+        return {
+            'id': tweet.id,
+            'username': tweet.user.screen_name,
+            'user_id': tweet.user.id,
+            'text': tweet.text,
+            'created_at': tweet.created_at,
+            'tweet_url': f"https://twitter.com/{tweet.user.screen_name}/status/{tweet.id}",
+            'is_reply': tweet.in_reply_to is not None,
+            'in_reply_to_id': tweet.in_reply_to
+        }
     
     async def get_dms(self, count: int = 20) -> List[Dict]:
         """
@@ -144,17 +237,40 @@ class TwitterClient:
             List of DM dictionaries
         """
         if not self.authenticated:
-            print("❌ Not authenticated. Call authenticate() first.")
+            logger.error("❌ Not authenticated. Call authenticate() first.")
             return []
         
         try:
             # Get DM conversations
             conversations = await self.client.get_dm_conversations()
+            conversations = conversations[:count]
+            
+            # Fetch every conversation's messages concurrently instead of
+            # one round trip after another
+            semaphore = asyncio.Semaphore(max(1, self.dm_fetch_concurrency))
+            
+            async def fetch_messages(conversation):
+                async with semaphore:
+                    return await asyncio.wait_for(
+                        conversation.get_messages(),
+                        timeout=self.dm_fetch_timeout
+                    )
+            
+            results = await asyncio.gather(
+                *(fetch_messages(conversation) for conversation in conversations),
+                return_exceptions=True
+            )
             
             dms = []
-            for conversation in conversations[:count]:
-                # Get messages from this conversation
-                messages = await conversation.get_messages()
+            for conversation, messages in zip(conversations, results):
+                if isinstance(messages, TooManyRequests):
+                    raise messages
+                if isinstance(messages, asyncio.TimeoutError):
+                    logger.warning(f"⚠️ Timed out fetching DM conversation {conversation.id}")
+                    continue
+                if isinstance(messages, Exception):
+                    logger.error(f"❌ Error fetching DM conversation {conversation.id}: {messages}")
+                    continue
                 
                 if messages:
                     latest_message = messages[0]
@@ -174,16 +290,42 @@ class TwitterClient:
                     }
                     dms.append(dm)
             
-            print(f"💬 Retrieved {len(dms)} new DMs")
+            logger.debug(f"💬 Retrieved {len(dms)} new DMs", extra={"count": len(dms)})
             return dms
             
         except TooManyRequests as e:
-            print(f"⚠️ Rate limit hit. Reset at: {e.rate_limit_reset}")
+            logger.warning(f"⚠️ Rate limit hit. Reset at: {e.rate_limit_reset}", extra={"rate_limit_reset": e.rate_limit_reset})
+            self._record_rate_limit("dms", e)
             return []
         except TwitterException as e:
-            print(f"❌ Error fetching DMs: {e}")
+            logger.error(f"❌ Error fetching DMs: {e}")
             return []
     
+    def _record_rate_limit(self, stream: str, error: TooManyRequests, default_wait: float = 60):
+        """Remember when a throttled stream may be polled again"""
+        reset = error.rate_limit_reset or time.time() + default_wait
+        self.rate_limit_resets[stream] = float(reset)
+    
+    def rate_limit_wait(self, stream: str) -> float:
+        """
+        Seconds until a stream's rate limit resets
+        
+        Args:
+            stream: "mentions", "dms", "replies" or "dm_sends"
+        
+        Returns:
+            Seconds to wait, 0 if the stream is not throttled
+        """
+        reset = self.rate_limit_resets.get(stream)
+        if reset is None:
+            return 0.0
+        
+        remaining = reset - time.time()
+        if remaining <= 0:
+            del self.rate_limit_resets[stream]
+            return 0.0
+        return remaining
+    
     async def reply_to_tweet(self, tweet_id: str, text: str) -> bool:
         """
         Reply to a tweet
@@ -196,7 +338,7 @@ class TwitterClient:
             bool: True if successful
         """
         if not self.authenticated:
-            print("❌ Not authenticated. Call authenticate() first.")
+            logger.error("❌ Not authenticated. Call authenticate() first.")
             return False
         
         try:
@@ -204,11 +346,15 @@ class TwitterClient:
                 text=text,
                 reply_to=tweet_id
             )
-            print(f"✅ Replied to tweet {tweet_id}")
+            logger.debug(f"✅ Replied to tweet {tweet_id}", extra={"tweet_id": tweet_id})
             return True
             
+        except TooManyRequests as e:
+            self._record_rate_limit("replies", e)
+            logger.warning(f"⏳ Rate limited replying to tweet {tweet_id}", extra={"tweet_id": tweet_id})
+            return False
         except TwitterException as e:
-            print(f"❌ Error replying to tweet: {e}")
+            logger.error(f"❌ Error replying to tweet: {e}", extra={"tweet_id": tweet_id, "error": str(e)})
             return False
     
     async def send_dm(self, user_id: str, text: str) -> bool:
@@ -223,16 +369,20 @@ class TwitterClient:
             bool: True if successful
         """
         if not self.authenticated:
-            print("❌ Not authenticated. Call authenticate() first.")
+            logger.error("❌ Not authenticated. Call authenticate() first.")
             return False
         
         try:
             await self.client.send_dm(user_id, text)
-            print(f"✅ Sent DM to user {user_id}")
+            logger.debug(f"✅ Sent DM to user {user_id}", extra={"user_id": user_id})
             return True
             
+        except TooManyRequests as e:
+            self._record_rate_limit("dm_sends", e)
+            logger.warning(f"⏳ Rate limited sending DM to user {user_id}", extra={"user_id": user_id})
+            return False
         except TwitterException as e:
-            print(f"❌ Error sending DM: {e}")
+            logger.error(f"❌ Error sending DM: {e}", extra={"user_id": user_id, "error": str(e)})
             return False
     
     async def post_tweet(self, text: str) -> bool:
@@ -246,26 +396,42 @@ class TwitterClient:
             bool: True if successful
         """
         if not self.authenticated:
-            print("❌ Not authenticated. Call authenticate() first.")
+            logger.error("❌ Not authenticated. Call authenticate() first.")
             return False
         
         try:
             tweet = await self.client.create_tweet(text=text)
-            print(f"✅ Posted tweet: {text[:50]}...")
+            logger.info(f"✅ Posted tweet: {text[:50]}...")
             return True
             
         except TwitterException as e:
-            print(f"❌ Error posting tweet: {e}")
+            logger.error(f"❌ Error posting tweet: {e}")
             return False
 
 
-# Singleton instance
-twitter_client = TwitterClient()
+# Shared client for the env-configured account, created on first use
+_twitter_client = None
+
+
+def get_twitter_client() -> TwitterClient:
+    """Get the client for the account configured in .env"""
+    global _twitter_client
+    if _twitter_client is None:
+        _twitter_client = TwitterClient()
+    return _twitter_client
+
+
+def __getattr__(name: str):
+    # Keeps `from twitter_client import twitter_client` working
+    if name == "twitter_client":
+        return get_twitter_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 async def test_connection():
     """Test Twitter connection"""
     print("\n🧪 Testing Twitter Connection...")
+    twitter_client = get_twitter_client()
     
     if await twitter_client.authenticate():
         print("\n📱 Fetching mentions...")
@@ -4,7 +4,12 @@ Twitter message handler with mock data for testing
 from typing import Dict, Optional
 import gemini_handler
 import slack_handler
-from database import db
+from database import get_db
+from logging_setup import get_logger
+from metrics import escalations_total, messages_total, stage_seconds
+
+
+logger = get_logger(__name__)
 
 
 class TwitterHandler:
@@ -16,7 +21,9 @@ class TwitterHandler:
         username: str,
         message: str,
         is_dm: bool = False,
-        tweet_url: str = None
+        tweet_url: str = None,
+        tweet_id: str = None,
+        intent: str = None
     ) -> Dict:
         """
         Process a Twitter message (mention or DM) and generate response
@@ -26,24 +33,60 @@ class TwitterHandler:
             message: The message content
             is_dm: Whether this is a DM
             tweet_url: URL to the tweet
+            tweet_id: ID of the source tweet/DM, stored with the conversation
+            intent: Pre-computed intent (e.g. from classify_intents_batch);
+                classified here when omitted
         
         Returns:
             Dict with response and metadata
         """
-        print(f"\n{'='*60}")
-        print(f"Processing {'DM' if is_dm else 'Tweet'} from @{username}")
-        print(f"Message: {message}")
-        print(f"{'='*60}")
+        channel = "dm" if is_dm else "mention"
+        logger.debug(
+            f"Processing {'DM' if is_dm else 'Tweet'} from @{username}: {message}",
+            extra={"username": username, "channel": channel, "tweet_id": tweet_id, "text": message}
+        )
         
-        # Get user's previous state
-        user_state = db.get_user_state(username)
+        with stage_seconds.time(stage="process_message"):
+            result = self._process(username, message, is_dm, tweet_url, tweet_id, intent)
+        
+        messages_total.inc(intent=result["intent"], channel=channel)
+        logger.info(
+            f"📊 @{username} ({channel}): {result['intent']}"
+            + (f", escalated ticket #{result['ticket_number']}" if result["escalated"] else ""),
+            extra={
+                "username": username,
+                "channel": channel,
+                "tweet_id": tweet_id,
+                "intent": result["intent"],
+                "ticket_number": result["ticket_number"],
+                "escalated": result["escalated"],
+            }
+        )
+        logger.debug(f"💬 Response: {result['response']}", extra={"username": username, "response": result["response"]})
+        return result
+    
+    def _process(
+        self,
+        username: str,
+        message: str,
+        is_dm: bool,
+        tweet_url: Optional[str],
+        tweet_id: Optional[str],
+        intent: Optional[str]
+    ) -> Dict:
+        """process_message without the overall timing"""
+        db = get_db()
         
-        # Classify intent
-        intent = gemini_handler.classify_intent(message, is_dm)
-        print(f"📊 Intent: {intent}")
+        # Get user's previous state
+        with stage_seconds.time(stage="user_state_read"):
+            user_state = db.get_user_state(username)
         
-        # Extract ticket number if present
-        ticket_number = gemini_handler.extract_ticket_number(message)
+        # Classify intent (timed as "classify" inside gemini_handler) and
+        # extract the ticket number if present
+        if intent is None:
+            intent, ticket_number = gemini_handler.classify_message(message, is_dm)
+        else:
+            ticket_number = gemini_handler.extract_ticket_number(message)
         
         # Handle special cases
         response = None
@@ -55,14 +98,16 @@ class TwitterHandler:
         
         # Case 2: DM with ticket number
         elif intent == "dm_ticket_shared" and is_dm and ticket_number:
-            # Escalate to Slack
-            original_complaint = self._get_original_complaint(username)
-            slack_handler.send_escalation(
-                ticket_number=ticket_number,
-                username=username,
-                tweet_url=tweet_url,
-                original_message=original_complaint
-            )
+            # Escalate to Slack (queued; delivered by the background dispatcher)
+            with stage_seconds.time(stage="escalation"):
+                original_complaint = db.get_original_complaint(username)
+                slack_handler.enqueue_escalation(
+                    ticket_number=ticket_number,
+                    username=username,
+                    tweet_url=tweet_url,
+                    original_message=original_complaint
+                )
+            escalations_total.inc()
             response = gemini_handler.generate_response(
                 "dm_ticket_received",
                 ticket_number=ticket_number
@@ -90,25 +135,25 @@ class TwitterHandler:
         else:
             response = gemini_handler.generate_response("new_complaint")
         
-        # Save to database
-        db.save_conversation(
-            username=username,
-            message=message,
-            intent=intent,
-            response=response,
-            is_dm=is_dm,
-            ticket_number=ticket_number,
-            escalated=escalated
-        )
-        
-        # Update user state
-        db.update_user_state(
-            username=username,
-            intent=intent,
-            ticket_number=ticket_number
-        )
-        
-        print(f"\n💬 Response: {response}")
+        with stage_seconds.time(stage="db_write"):
+            # Save to database
+            db.save_conversation(
+                username=username,
+                message=message,
+                intent=intent,
+                response=response,
+                is_dm=is_dm,
+                ticket_number=ticket_number,
+                escalated=escalated,
+                tweet_id=tweet_id
+            )
+            
+            # Update user state
+            db.update_user_state(
+                username=username,
+                intent=intent,
+                ticket_number=ticket_number
+            )
         
         return {
             "username": username,
@@ -118,15 +163,22 @@ class TwitterHandler:
             "escalated": escalated,
             "is_dm": is_dm
         }
-    
-    def _get_original_complaint(self, username: str) -> Optional[str]:
-        """Get the original complaint message from user's history"""
-        history = db.get_conversation_history(username, limit=5)
-        for conv in history:
-            if conv["intent"] in ["new_complaint", "has_ticket"]:
-                return conv["message"]
-        return None
 
 
-# Global instance
-handler = TwitterHandler()
+# Shared handler, created on first use by get_handler()
+_handler = None
+
+
+def get_handler() -> TwitterHandler:
+    """Get the shared message handler"""
+    global _handler
+    if _handler is None:
+        _handler = TwitterHandler()
+    return _handler
+
+
+def __getattr__(name: str):
+    # Keeps `from twitter_handler import handler` working
+    if name == "handler":
+        return get_handler()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
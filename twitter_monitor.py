@@ -3,166 +3,513 @@ Twitter Monitor - Continuously monitors mentions and DMs
 Integrates with existing twitter_handler.py for processing
 """
 import asyncio
-from datetime import datetime
-from typing import Set
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple
 import os
-from twitter_client import twitter_client
+import signal
 from twitter_handler import TwitterHandler
-from database import db
+from database import get_db
+import gemini_handler
+import slack_handler
+from concurrency import gather_in_key_order
+from reply_queue import ReplyQueue
+from logging_setup import get_logger
+import config
+import metrics
+
+# twikit is imported with twitter_client, when the monitor first needs a client
+if TYPE_CHECKING:
+    from twitter_client import TwitterClient
+
+logger = get_logger(__name__)
+
+
+# Extra seconds to wait past a rate limit reset
+RATE_LIMIT_MARGIN = 2
+
+
+class AdaptiveInterval:
+    def __init__(
+        self,
+        base: float,
+        minimum: float,
+        maximum: float,
+        speedup: float = 0.5,
+        backoff: float = 1.5
+    ):
+        """
+        Poll interval that tightens when busy and backs off when idle
+        
+        Args:
+            base: Starting interval in seconds
+            minimum: Shortest interval
+            maximum: Longest interval
+            speedup: Factor applied after a poll that found new items
+            backoff: Factor applied after an empty poll
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.speedup = speedup
+        self.backoff = backoff
+        self.current = min(max(base, minimum), maximum)
+    
+    def update(self, new_items: int) -> float:
+        """Adjust for the last poll's traffic and return the next interval"""
+        if new_items > 0:
+            self.current = max(self.minimum, self.current * self.speedup)
+        else:
+            self.current = min(self.maximum, self.current * self.backoff)
+        return self.current
 
 
 class TwitterMonitor:
-    def __init__(self, poll_interval: int = 60):
+    def __init__(
+        self,
+        poll_interval: int = 60,
+        max_concurrency: int = 5,
+        min_poll_interval: int = None,
+        max_poll_interval: int = None,
+        mention_page_size: int = 20,
+        mention_max_pages: int = 10,
+        client: "TwitterClient" = None,
+        account: str = ""
+    ):
         """
         Initialize Twitter Monitor
         
         Args:
-            poll_interval: Seconds between each poll (default: 60)
+            poll_interval: Starting seconds between polls (default: 60)
+            max_concurrency: Messages processed in parallel per poll (default: 5)
+            min_poll_interval: Fastest polling when busy (default: poll_interval / 4)
+            max_poll_interval: Slowest polling when idle (default: poll_interval * 5)
+            mention_page_size: Mentions fetched per search page (default: 20)
+            mention_max_pages: Pages followed per poll when catching up (default: 10)
+            client: Account to monitor (default: the env-configured twitter_client)
+            account: Name of the account, namespacing its stream cursors and
+                queued replies when several accounts share the database
         """
         self.poll_interval = poll_interval
+        self.min_poll_interval = min_poll_interval or max(5, poll_interval // 4)
+        self.max_poll_interval = max_poll_interval or poll_interval * 5
+        self.max_concurrency = max(1, max_concurrency)
+        self.mention_page_size = mention_page_size
+        self.mention_max_pages = max(1, mention_max_pages)
+        if client is None:
+            from twitter_client import get_twitter_client
+            client = get_twitter_client()
+        self.client = client
+        self.account = account
         self.handler = TwitterHandler()
-        self.processed_ids: Set[str] = set()
+        self.reply_queue = ReplyQueue(self.client, account=account)
         self.running = False
+        self._stopping = asyncio.Event()
         
-        # Load previously processed IDs from database
-        self._load_processed_ids()
+        # process_message does blocking Gemini, SQLite and Slack I/O, so it
+        # runs on this pool instead of the event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="monitor-handler"
+        )
     
-    def _load_processed_ids(self):
-        """Load previously processed tweet/DM IDs to avoid duplicates"""
-        # Get recent processed IDs from database
-        recent = db.get_recent_conversations(limit=100)
-        for conv in recent:
-            if 'tweet_id' in conv:
-                self.processed_ids.add(conv['tweet_id'])
+    def _cursor_name(self, stream: str) -> str:
+        """Cursor key for a stream, prefixed with the account when named"""
+        return f"{self.account}/{stream}" if self.account else stream
     
-    async def process_mentions(self):
-        """Fetch and process new mentions"""
-        print(f"\n📬 Checking mentions... [{datetime.now().strftime('%H:%M:%S')}]")
+    async def _run_db(self, method, *args):
+        """
+        Run a ConversationDB call on the executor
         
-        mentions = await twitter_client.get_mentions(count=20)
-        new_mentions = 0
+        Ledger and cursor writes can wait on another process's write lock
+        for up to the busy timeout, which must not stall the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(method, *args))
+    
+    async def _run_handler(self, **kwargs) -> Dict:
+        """Run handler.process_message on the executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(self.handler.process_message, **kwargs)
+        )
+    
+    async def _process_items(self, items: List[Dict], worker) -> Tuple[int, Set[str]]:
+        """
+        Process items concurrently, keeping each user's messages in order
         
-        for mention in mentions:
-            # Skip if already processed
-            if mention['id'] in self.processed_ids:
-                continue
-            
-            # Process the mention
-            result = self.handler.process_message(
-                username=mention['username'],
-                message=mention['text'],
-                is_dm=False,
-                tweet_url=mention['tweet_url']
+        Items already in the processed ledger are skipped without touching
+        the handler.
+        
+        Returns:
+            Number of items handled successfully, and the IDs of every item
+            that is now done (handled here or earlier)
+        """
+        # Oldest first, so each user's messages are answered in the order sent
+        items = sorted(items, key=lambda item: int(item['id']))
+        done = await self._run_db(get_db().processed_ids, [item['id'] for item in items])
+        pending = [item for item in items if item['id'] not in done]
+        
+        # Classify the whole poll in one Gemini round trip
+        if pending:
+            intents = await gemini_handler.classify_intents_batch_async(
+                [(item['text'], item.get('is_dm', False)) for item in pending]
             )
-            
-            # Send reply
-            if result.get('response'):
-                success = await twitter_client.reply_to_tweet(
-                    tweet_id=mention['id'],
-                    text=result['response']
+            pending = [dict(item, intent=intent) for item, intent in zip(pending, intents)]
+        
+        results = await gather_in_key_order(
+            pending,
+            key=lambda item: item['username'],
+            worker=worker,
+            limit=self.max_concurrency
+        )
+        
+        handled = 0
+        for item, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"❌ Error processing message from @{item['username']}: {result}",
+                    exc_info=result,
+                    extra={"account": self.account, "username": item['username'], "message_id": item['id']}
                 )
-                
-                if success:
-                    print(f"✅ Replied to @{mention['username']}")
-                    self.processed_ids.add(mention['id'])
-                    new_mentions += 1
-                else:
-                    print(f"❌ Failed to reply to @{mention['username']}")
+            elif result:
+                done.add(item['id'])
+                handled += 1
+        
+        return handled, done
+    
+    async def _process_batch(self, items: List[Dict], worker, stream: str) -> int:
+        """
+        Process one fetched batch and advance the stream's cursor
+        
+        Items at or below the stream's cursor are dropped up front.
+        
+        Returns:
+            Number of items handled successfully
+        """
+        cursor = await self._run_db(get_db().get_cursor, self._cursor_name(stream))
+        if cursor is not None:
+            items = [item for item in items if int(item['id']) > int(cursor)]
+        
+        handled, done = await self._process_items(items, worker)
+        
+        # Advance the cursor over the contiguous run of finished messages;
+        # anything after the first failure is retried on the next poll
+        last_done = None
+        for item in sorted(items, key=lambda item: int(item['id'])):
+            if item['id'] not in done:
+                break
+            last_done = item['id']
+        if last_done is not None:
+            await self._run_db(get_db().advance_cursor, self._cursor_name(stream), last_done)
+        
+        return handled
+    
+    async def _handle_mention(self, mention: Dict) -> bool:
+        """Process a single mention and queue its reply"""
+        result = await self._run_handler(
+            username=mention['username'],
+            message=mention['text'],
+            is_dm=False,
+            tweet_url=mention['tweet_url'],
+            tweet_id=mention['id'],
+            intent=mention.get('intent')
+        )
+        
+        # Queue the reply; a failed send is retried by the reply queue
+        # without running the pipeline again
+        if not result.get('response'):
+            return False
+        
+        await self.reply_queue.enqueue(
+            message_id=mention['id'],
+            kind="mention",
+            target=mention['id'],
+            text=result['response'],
+            username=mention['username']
+        )
+        return True
+    
+    async def _handle_dm(self, dm: Dict) -> bool:
+        """Process a single DM and queue its reply"""
+        result = await self._run_handler(
+            username=dm['username'],
+            message=dm['text'],
+            is_dm=True,
+            tweet_url=None,
+            tweet_id=dm['id'],
+            intent=dm.get('intent')
+        )
+        
+        # Queue the DM reply
+        if not result.get('response'):
+            return False
+        
+        await self.reply_queue.enqueue(
+            message_id=dm['id'],
+            kind="dm",
+            target=dm['user_id'],
+            text=result['response'],
+            username=dm['username']
+        )
+        return True
+    
+    async def process_mentions(self) -> int:
+        """
+        Fetch and process new mentions
+        
+        Returns:
+            Number of mentions handled
+        """
+        from twikit.errors import TwitterException
+        
+        logger.debug("📬 Checking mentions...", extra={"account": self.account, "stream": "mentions"})
+        
+        since_id = await self._run_db(get_db().get_cursor, self._cursor_name("mentions"))
+        
+        # A catch-up that ran out of pages leaves a gap between the cursor
+        # and the oldest mention it reached; drain that before newer mentions
+        gap_top = await self._run_db(get_db().get_cursor, self._cursor_name("mentions:gap"))
+        max_id = str(int(gap_top) - 1) if gap_top is not None else None
+        
+        new_mentions = 0
+        newest_id = None
+        oldest_id = None
+        pages = 0
+        all_done = True
+        
+        # Pages arrive newest first, so positions only move once the whole
+        # pass is done; pages handled before a failure stay in the ledger
+        try:
+            async for page in self.client.iter_mentions(
+                since_id=since_id,
+                max_id=max_id,
+                page_size=self.mention_page_size,
+                max_pages=self.mention_max_pages
+            ):
+                pages += 1
+                if page:
+                    newest_id = newest_id or page[0]['id']
+                    oldest_id = page[-1]['id']
+                handled, done = await self._process_items(page, self._handle_mention)
+                new_mentions += handled
+                if len(done) < len(page):
+                    all_done = False
+        except TwitterException as e:
+            logger.error(f"❌ Error fetching mentions: {e}", extra={"account": self.account, "stream": "mentions"})
+            all_done = False
+        
+        if all_done:
+            await self._run_db(self._advance_mention_positions, since_id, gap_top, newest_id, oldest_id, pages)
         
         if new_mentions > 0:
-            print(f"✅ Processed {new_mentions} new mentions")
+            logger.info(
+                f"✅ Processed {new_mentions} new mentions",
+                extra={"account": self.account, "stream": "mentions", "handled": new_mentions, "pages": pages}
+            )
         else:
-            print("📭 No new mentions")
+            logger.debug("📭 No new mentions", extra={"account": self.account, "stream": "mentions"})
+        return new_mentions
     
-    async def process_dms(self):
-        """Fetch and process new DMs"""
-        print(f"\n💬 Checking DMs... [{datetime.now().strftime('%H:%M:%S')}]")
+    def _advance_mention_positions(
+        self,
+        since_id: str,
+        gap_top: str,
+        newest_id: str,
+        oldest_id: str,
+        pages: int
+    ):
+        """
+        Record how far a fully handled mentions pass got (blocking; run
+        through _run_db)
         
-        dms = await twitter_client.get_dms(count=20)
-        new_dms = 0
+        "mentions" is the cursor below which everything is done,
+        "mentions:newest" the newest mention seen while a gap is open, and
+        "mentions:gap" the oldest mention reached by a pass that used its
+        whole page budget (it may have stopped short of the cursor).
+        """
+        db = get_db()
+        truncated = since_id is not None and pages >= self.mention_max_pages
+        cursor = self._cursor_name("mentions")
+        newest = self._cursor_name("mentions:newest")
+        gap = self._cursor_name("mentions:gap")
         
-        for dm in dms:
-            # Skip if already processed
-            if dm['id'] in self.processed_ids:
-                continue
-            
-            # Process the DM
-            result = self.handler.process_message(
-                username=dm['username'],
-                message=dm['text'],
-                is_dm=True,
-                tweet_url=None
+        if truncated:
+            if gap_top is None and newest_id is not None:
+                db.advance_cursor(newest, newest_id)
+            if oldest_id is not None:
+                db.set_cursor(gap, oldest_id)
+        elif gap_top is not None:
+            # Gap drained: everything up to the newest mention seen is done
+            db.advance_cursor(cursor, db.get_cursor(newest) or gap_top)
+            db.clear_cursor(gap)
+        elif newest_id is not None:
+            db.advance_cursor(cursor, newest_id)
+    
+    async def process_dms(self) -> int:
+        """
+        Fetch and process new DMs
+        
+        Returns:
+            Number of DMs handled
+        """
+        logger.debug("💬 Checking DMs...", extra={"account": self.account, "stream": "dms"})
+        
+        dms = await self.client.get_dms(count=20)
+        new_dms = await self._process_batch(dms, self._handle_dm, "dms")
+        
+        if new_dms > 0:
+            logger.info(
+                f"✅ Processed {new_dms} new DMs",
+                extra={"account": self.account, "stream": "dms", "handled": new_dms}
             )
+        else:
+            logger.debug("📭 No new DMs", extra={"account": self.account, "stream": "dms"})
+        return new_dms
+    
+    async def _stream_loop(self, stream: str, poll):
+        """
+        Poll one stream on its own adaptive schedule
+        
+        Args:
+            stream: "mentions" or "dms"
+            poll: Coroutine function returning the number of items handled
+        """
+        interval = AdaptiveInterval(
+            self.poll_interval,
+            self.min_poll_interval,
+            self.max_poll_interval
+        )
+        iteration = 0
+        fields = {"account": self.account, "stream": stream}
+        
+        while self.running:
+            iteration += 1
+            logger.debug(f"🔄 [{stream}] Poll #{iteration}", extra=dict(fields, poll=iteration))
+            
+            try:
+                handled = await poll()
+            except Exception as e:
+                logger.exception(f"❌ Error polling {stream}: {e}", extra=fields)
+                handled = 0
             
-            # Send DM reply
-            if result.get('response'):
-                success = await twitter_client.send_dm(
-                    user_id=dm['user_id'],
-                    text=result['response']
+            # When throttled, sleep exactly until the limit resets
+            throttled = self.client.rate_limit_wait(stream)
+            if throttled > 0:
+                delay = throttled + RATE_LIMIT_MARGIN
+                logger.warning(
+                    f"⏳ [{stream}] Rate limited, sleeping {delay:.0f}s until reset",
+                    extra=dict(fields, sleep=delay)
                 )
-                
-                if success:
-                    print(f"✅ Replied to DM from @{dm['username']}")
-                    self.processed_ids.add(dm['id'])
-                    new_dms += 1
-                else:
-                    print(f"❌ Failed to reply to DM from @{dm['username']}")
+            else:
+                delay = interval.update(handled)
+                logger.debug(f"⏸️  [{stream}] Next poll in {delay:.0f} seconds", extra=dict(fields, sleep=delay))
+            
+            await self._pause(delay)
+    
+    async def _pause(self, seconds: float):
+        """Sleep between polls, waking early when the monitor is stopped"""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _metrics_loop(self):
+        """Log a metrics snapshot every METRICS_SNAPSHOT_INTERVAL seconds"""
+        interval = config.METRICS_SNAPSHOT_INTERVAL
+        if interval <= 0:
+            return
         
-        if new_dms > 0:
-            print(f"✅ Processed {new_dms} new DMs")
-        else:
-            print("📭 No new DMs")
+        while self.running:
+            await self._pause(interval)
+            if not self.running:
+                break
+            # Queue gauges query SQLite, so collect off the event loop
+            snapshot = await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                metrics.registry.snapshot
+            )
+            logger.info(
+                f"📈 Metrics snapshot\n{metrics.format_snapshot(snapshot)}",
+                extra={"account": self.account, "metrics": snapshot}
+            )
     
     async def monitor_loop(self):
         """Main monitoring loop"""
-        print("\n" + "="*60)
-        print("🤖 AI Twitter Intern - Starting Monitor")
-        print("="*60)
+        title = "🤖 AI Twitter Intern - Starting Monitor"
+        if self.account:
+            title += f" [{self.account}]"
+        logger.info(title, extra={"account": self.account})
         
         # Authenticate
-        if not await twitter_client.authenticate():
-            print("❌ Authentication failed. Exiting.")
+        if not await self.client.authenticate():
+            logger.error("❌ Authentication failed. Exiting.", extra={"account": self.account})
             return
         
-        print(f"\n⏰ Polling every {self.poll_interval} seconds")
+        # Deliver escalations left in the outbox by a previous run
+        slack_handler.dispatcher.start()
+        
+        logger.info(
+            f"⏰ Polling every {self.min_poll_interval}-{self.max_poll_interval} seconds "
+            f"(starting at {self.poll_interval}), adapting to traffic; "
+            f"processing up to {self.max_concurrency} messages in parallel",
+            extra={"account": self.account}
+        )
         print("Press Ctrl+C to stop\n")
         
         self.running = True
-        iteration = 0
+        # SIGTERM (e.g. from the supervisor) finishes the current round and
+        # stops the reply queue instead of killing the loop mid-send
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.stop)
         
         try:
-            while self.running:
-                iteration += 1
-                print(f"\n{'='*60}")
-                print(f"🔄 Poll #{iteration} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                print(f"{'='*60}")
-                
-                # Process mentions and DMs
-                await self.process_mentions()
-                await self.process_dms()
-                
-                # Wait before next poll
-                print(f"\n⏸️  Sleeping for {self.poll_interval} seconds...")
-                await asyncio.sleep(self.poll_interval)
+            # Mentions and DMs run independently, each on its own schedule;
+            # the reply queue sends what they decide at X's write rate
+            await asyncio.gather(
+                self._stream_loop("mentions", self.process_mentions),
+                self._stream_loop("dms", self.process_dms),
+                self.reply_queue.run(),
+                self._metrics_loop()
+            )
                 
         except KeyboardInterrupt:
-            print("\n\n⚠️  Shutting down gracefully...")
-            self.running = False
+            self.stop()
         except Exception as e:
-            print(f"\n❌ Error in monitor loop: {e}")
+            logger.exception(f"❌ Error in monitor loop: {e}", extra={"account": self.account})
             raise
+        finally:
+            self._executor.shutdown(wait=True)
+            slack_handler.dispatcher.stop()
+    
+    def stop(self):
+        """Stop polling and sending once the current round is done"""
+        logger.info("⚠️  Shutting down gracefully...", extra={"account": self.account})
+        self.running = False
+        self.reply_queue.stop()
+        self._stopping.set()
     
     def start(self):
         """Start the monitor"""
         asyncio.run(self.monitor_loop())
 
 
-def main():
-    """Main entry point"""
+def monitor_settings_from_env() -> Dict:
+    """Read TwitterMonitor keyword arguments from the environment"""
     # Get poll interval from env or default to 60 seconds
     poll_interval = int(os.getenv("TWITTER_POLL_INTERVAL", "60"))
-    
-    monitor = TwitterMonitor(poll_interval=poll_interval)
+    return {
+        "poll_interval": poll_interval,
+        "min_poll_interval": int(os.getenv("TWITTER_MIN_POLL_INTERVAL", str(max(5, poll_interval // 4)))),
+        "max_poll_interval": int(os.getenv("TWITTER_MAX_POLL_INTERVAL", str(poll_interval * 5))),
+        "max_concurrency": int(os.getenv("TWITTER_MAX_CONCURRENCY", "5")),
+        "mention_page_size": int(os.getenv("TWITTER_MENTIONS_PAGE_SIZE", "20")),
+        "mention_max_pages": int(os.getenv("TWITTER_MENTIONS_MAX_PAGES", "10")),
+    }
+
+
+def main():
+    """Main entry point"""
+    monitor = TwitterMonitor(**monitor_settings_from_env())
     monitor.start()
 
 
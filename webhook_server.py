@@ -1,11 +1,20 @@
 """
 FastAPI webhook endpoint for n8n integration
 """
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-from twitter_handler import handler
-import uvicorn
+from typing import Dict, List, Optional
+from twitter_handler import get_handler
+from concurrency import gather_in_key_order
+from idempotency import idempotency_store
+from metrics import registry
+import config
+import gemini_handler
+import slack_handler
 
 app = FastAPI(title="Twitter Support Bot API")
 
@@ -15,6 +24,7 @@ class TwitterMessage(BaseModel):
     message: str
     is_dm: bool = False
     tweet_url: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
 
 class WebhookResponse(BaseModel):
@@ -25,26 +35,48 @@ class WebhookResponse(BaseModel):
     escalated: bool = False
 
 
-@app.get("/")
-async def root():
-    """Health check endpoint"""
-    return {"status": "ok", "service": "Twitter Support Bot"}
+class BatchItemResult(BaseModel):
+    index: int
+    success: bool
+    intent: Optional[str] = None
+    response: Optional[str] = None
+    ticket_number: Optional[str] = None
+    escalated: bool = False
+    error: Optional[str] = None
 
 
-@app.post("/webhook/twitter", response_model=WebhookResponse)
-async def process_twitter_message(data: TwitterMessage):
+class BatchWebhookResponse(BaseModel):
+    success: bool
+    results: List[BatchItemResult]
+
+
+async def _process(
+    data: TwitterMessage,
+    intent: Optional[str] = None,
+    idempotency_key: Optional[str] = None
+) -> WebhookResponse:
     """
-    Main webhook endpoint for n8n to send Twitter messages
+    Run one message through the handler without blocking the event loop
     
-    This endpoint receives Twitter mentions or DMs from n8n,
-    processes them, and returns the bot's response.
+    Classification is awaited on the async Gemini client (unless the intent
+    is already known), with intent cache lookups that reach SQLite run in
+    the executor; the rest of process_message does blocking SQLite work,
+    so it runs in the threadpool. Nothing on this path touches the
+    database from the event loop. With an idempotency key (argument or
+    message field) a retry replays the stored response instead.
     """
-    try:
-        result = handler.process_message(
+    async def compute() -> Dict:
+        message_intent = intent
+        if message_intent is None:
+            message_intent = await gemini_handler.classify_intent_async(data.message, data.is_dm)
+        
+        result = await run_in_threadpool(
+            get_handler().process_message,
             username=data.username,
             message=data.message,
             is_dm=data.is_dm,
-            tweet_url=data.tweet_url
+            tweet_url=data.tweet_url,
+            intent=message_intent
         )
         
         return WebhookResponse(
@@ -53,12 +85,234 @@ async def process_twitter_message(data: TwitterMessage):
             response=result["response"],
             ticket_number=result.get("ticket_number"),
             escalated=result["escalated"]
-        )
+        ).model_dump()
+    
+    key = idempotency_key or data.idempotency_key
+    return WebhookResponse(**await idempotency_store.run(key, compute))
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    """Start delivering queued (and previously undelivered) escalations"""
+    slack_handler.dispatcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    """Let the Slack dispatcher finish its current delivery"""
+    slack_handler.dispatcher.stop()
+
+
+@app.get("/")
+async def root():
+    """Health check endpoint"""
+    return {"status": "ok", "service": "Twitter Support Bot"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics (stage latencies, counters, cache and queue gauges)"""
+    # Queue gauges query SQLite, so collect off the event loop
+    body = await run_in_threadpool(registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/webhook/twitter", response_model=WebhookResponse)
+async def process_twitter_message(
+    data: TwitterMessage,
+    idempotency_key: Optional[str] = Header(default=None)
+):
+    """
+    Main webhook endpoint for n8n to send Twitter messages
+    
+    This endpoint receives Twitter mentions or DMs from n8n,
+    processes them, and returns the bot's response. Send an
+    Idempotency-Key header (or idempotency_key field) so n8n retries
+    get the original response instead of being processed again.
+    """
+    try:
+        return await _process(data, idempotency_key=idempotency_key)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/webhook/twitter/batch", response_model=BatchWebhookResponse)
+async def process_twitter_batch(messages: List[TwitterMessage]):
+    """
+    Batch webhook endpoint so n8n can push a whole poll in one request
+    
+    The batch is classified in as few Gemini calls as possible, then
+    processed concurrently (WEBHOOK_BATCH_CONCURRENCY at a time, each user's
+    messages in order). Failures are reported per item. Items carrying an
+    idempotency_key that was already answered are replayed, not reprocessed.
+    """
+    if len(messages) > config.WEBHOOK_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large (max {config.WEBHOOK_MAX_BATCH_SIZE} messages)"
+        )
+    
+    # Only classify items that don't already have a stored response
+    to_classify = []
+    for index, data in enumerate(messages):
+        if data.idempotency_key is None or await idempotency_store.lookup(data.idempotency_key) is None:
+            to_classify.append(index)
+    
+    intents: List[Optional[str]] = [None] * len(messages)
+    classified = await gemini_handler.classify_intents_batch_async(
+        [(messages[index].message, messages[index].is_dm) for index in to_classify]
+    )
+    for index, intent in zip(to_classify, classified):
+        intents[index] = intent
+    items = list(enumerate(zip(messages, intents)))
+    
+    async def process_item(item) -> WebhookResponse:
+        _, (data, intent) = item
+        return await _process(data, intent)
+    
+    outcomes = await gather_in_key_order(
+        items,
+        key=lambda item: item[1][0].username,
+        worker=process_item,
+        limit=config.WEBHOOK_BATCH_CONCURRENCY
+    )
+    
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            results.append(BatchItemResult(index=index, success=False, error=str(outcome)))
+        else:
+            results.append(BatchItemResult(index=index, **outcome.model_dump()))
+    
+    return BatchWebhookResponse(
+        success=all(result.success for result in results),
+        results=results
+    )
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming response that leaves the request body alone
+    
+    Starlette's StreamingResponse listens for client disconnects by reading
+    from `receive`, which would swallow request body chunks we are still
+    consuming while results stream out. Disconnects surface through
+    request.stream() instead.
+    """
+    media_type = "application/x-ndjson"
+    
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _stream_results(request: Request):
+    """
+    Process an NDJSON request body and yield NDJSON results as they finish
+    
+    At most WEBHOOK_STREAM_CONCURRENCY messages are in flight or waiting
+    to be written out; reading the body pauses while all slots are busy,
+    so memory stays flat regardless of upload size or how slowly the
+    client reads the results. Each user's messages are still processed in order.
+    """
+    slots = asyncio.Semaphore(config.WEBHOOK_STREAM_CONCURRENCY)
+    results: asyncio.Queue = asyncio.Queue(maxsize=config.WEBHOOK_STREAM_CONCURRENCY * 2)
+    done = object()
+    tasks = set()
+    last_task_for_user: Dict[str, asyncio.Task] = {}
+    
+    async def process_line(line_number: int, data: TwitterMessage, previous: Optional[asyncio.Task]):
+        # The slot is held until the result is queued, so a slow reader
+        # stops new lines being read rather than piling up finished tasks
+        try:
+            try:
+                if previous is not None:
+                    await previous
+                response = await _process(data)
+                result = {"line": line_number, **response.model_dump()}
+            except Exception as e:
+                result = {"line": line_number, "success": False, "error": str(e)}
+            await results.put(result)
+        finally:
+            slots.release()
+    
+    async def schedule(line_number: int, raw: bytes):
+        if not raw.strip():
+            return
+        try:
+            data = TwitterMessage.model_validate_json(raw)
+        except ValueError as e:
+            await results.put({"line": line_number, "success": False, "error": str(e)})
+            return
+        
+        await slots.acquire()
+        task = asyncio.create_task(
+            process_line(line_number, data, last_task_for_user.get(data.username))
+        )
+        last_task_for_user[data.username] = task
+        tasks.add(task)
+        
+        def forget(finished: asyncio.Task, username: str = data.username):
+            tasks.discard(finished)
+            if last_task_for_user.get(username) is finished:
+                del last_task_for_user[username]
+        task.add_done_callback(forget)
+    
+    async def produce():
+        line_number = 0
+        buffer = b""
+        try:
+            async for chunk in request.stream():
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    line_number += 1
+                    await schedule(line_number, line)
+                
+                if len(buffer) > config.WEBHOOK_STREAM_MAX_LINE_BYTES:
+                    raise ValueError(f"Line {line_number + 1} exceeds {config.WEBHOOK_STREAM_MAX_LINE_BYTES} bytes")
+            
+            if buffer:
+                line_number += 1
+                await schedule(line_number, buffer)
+            
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            await results.put(done)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            result = await results.get()
+            if result is done:
+                break
+            yield json.dumps(result) + "\n"
+        
+        # Surface body/framing errors as a final NDJSON line
+        error = producer.exception()
+        if error is not None:
+            yield json.dumps({"success": False, "error": str(error)}) + "\n"
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+@app.post("/webhook/twitter/stream")
+async def stream_twitter_messages(request: Request):
+    """
+    Streaming NDJSON endpoint for bulk backfills
+    
+    The request body is newline-delimited TwitterMessage JSON; each
+    result is streamed back as one NDJSON line (with its input "line"
+    number) as soon as it completes, so results may arrive out of order.
+    """
+    return NDJSONStreamingResponse(_stream_results(request))
+
+
 @app.get("/webhook/test")
 async def test_webhook():
     """Test endpoint for n8n webhook validation"""
@@ -68,5 +322,9 @@ async def test_webhook():
 if __name__ == "__main__":
     print("🚀 Starting Twitter Support Bot API...")
     print("📍 Webhook URL: http://localhost:8000/webhook/twitter")
+    print("📦 Batch URL: http://localhost:8000/webhook/twitter/batch")
+    print("🌊 Stream URL: http://localhost:8000/webhook/twitter/stream")
     print("🧪 Test URL: http://localhost:8000/webhook/test")
+    print("📈 Metrics URL: http://localhost:8000/metrics")
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)